@@ -1,18 +1,50 @@
-from flask import Flask, request, send_file, render_template, jsonify
+from flask import Flask, request, send_file, send_from_directory, render_template, jsonify, Response, g
 from flask_cors import CORS
-from rembg import remove, new_session
-from PIL import Image
+from PIL import Image, ImageOps
 import io
 import numpy as np
+import cv2
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import random
+import re
 import base64
+import hashlib
 from pathlib import Path
 import time
+import logging
 from werkzeug.utils import secure_filename
+try:
+    import websocket  # websocket-client, for ComfyUI progress events
+except ImportError:
+    websocket = None
 from io import BytesIO
+import os
+import threading
+import multiprocessing
+import contextvars
+import queue
+import uuid
+import zipfile
+import tempfile
+import shutil
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 app = Flask(__name__)
+# The module logger has its own handler so its records (such as the per-request timing lines)
+# are written however the app is served; gunicorn and the CLI only configure their own loggers
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
 # Enable CORS with specific settings
 CORS(app, resources={
     r"/*": {
@@ -38,247 +70,2125 @@ AVAILABLE_MODELS = {
 
 # ComfyUI API settings
 COMFYUI_API = "http://127.0.0.1:8188"
+COMFYUI_HISTORY_POLL_INTERVAL = 5  # seconds between /history/<prompt_id> checks while waiting
+COMFYUI_PROMPT_TTL = 3600  # seconds finished prompt state is kept in memory
+COMFYUI_TIMEOUT = (3.05, 30)  # default (connect, read) timeout in seconds for ComfyUI calls
+COMFYUI_MAX_RETRIES = 2
+COMFYUI_POOL_SIZE = 16  # keep-alive connections to ComfyUI
+COMFYUI_VIEW_CHUNK_SIZE = 64 * 1024  # bytes per chunk when streaming images from /view
+COMFYUI_PIPELINE_TIMEOUT = 600  # seconds a generate-and-remove pipeline may run
 STYLIZE_WORKFLOW_FILE = "stylize_workflow.json"
 GENERATE_WORKFLOW_FILE = "generate_workflow.json"
 BASE_IMAGES_DIR = "base-img"
+# Base image catalog: thumbnails (longest side, in pixels) are generated for every base image
+# and kept on disk; the index is rebuilt when the directory changes or after RESCAN_INTERVAL
+BASE_IMAGE_THUMBNAIL_SIZES = (64, 128, 256)
+BASE_IMAGE_THUMBNAIL_DIR = os.environ.get('BASE_IMAGE_THUMBNAIL_DIR', os.path.join(BASE_IMAGES_DIR, '.thumbnails'))
+BASE_IMAGE_RESCAN_INTERVAL = 60  # seconds; catches files overwritten in place, which keep the directory mtime
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # Cache-Control max-age for content-addressed URLs
 
-def fit_to_canvas(image, padding_percent):
+# rembg session pool settings
+SESSION_POOL_SIZE = int(os.environ.get('REMBG_SESSION_POOL_SIZE', 2))
+DEFAULT_MODEL = os.environ.get('REMBG_DEFAULT_MODEL', 'u2net')
+# Comma-separated models to load in the background at startup, e.g. "u2net,silueta" (lazy if
+# empty); /readyz reports ready once they have loaded
+PRELOAD_MODELS = [m.strip() for m in os.environ.get('REMBG_PRELOAD_MODELS', '').split(',') if m.strip()]
+
+# onnxruntime session options, the defaults for every model (see session_options)
+# INFERENCE_CONCURRENCY is how many model runs execute at once on this host (e.g. gunicorn workers
+# x batch process workers); each gets an equal share of the cores so they don't oversubscribe
+INFERENCE_CONCURRENCY = int(os.environ.get('INFERENCE_CONCURRENCY', os.environ.get('WEB_CONCURRENCY', 1)))
+# Default size of each per-process thread pool below: this worker's share of the host's cores
+WORKER_CPU_SHARE = max(1, (os.cpu_count() or 2) // max(1, int(os.environ.get('WEB_CONCURRENCY', 1))))
+ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', 0))  # 0 = cores / INFERENCE_CONCURRENCY
+ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', 1))  # only used in parallel mode
+ORT_EXECUTION_MODE = os.environ.get('ORT_EXECUTION_MODE', 'sequential')  # 'sequential' or 'parallel'
+ORT_GRAPH_OPTIMIZATION = os.environ.get('ORT_GRAPH_OPTIMIZATION', 'all')  # disable, basic, extended, all
+ORT_CPU_MEM_ARENA = os.environ.get('ORT_CPU_MEM_ARENA', '1') != '0'
+ORT_MEM_PATTERN = os.environ.get('ORT_MEM_PATTERN', '1') != '0'
+# Spin-waiting pool threads cut latency when idle cores exist; defaults off when runs share the CPU
+ORT_ALLOW_SPINNING = os.environ.get('ORT_ALLOW_SPINNING', '1' if INFERENCE_CONCURRENCY <= 1 else '0') != '0'
+# Directory to save each model's optimized graph in; later loads skip graph optimization
+ORT_OPTIMIZED_MODEL_DIR = os.environ.get('ORT_OPTIMIZED_MODEL_DIR')
+# JSON object of per-model overrides, e.g. '{"isnet-general-use": {"intra_op_threads": 8}}'
+ORT_MODEL_OPTIONS = json.loads(os.environ.get('ORT_MODEL_OPTIONS') or '{}')
+
+# Batch background removal settings
+BATCH_EXECUTOR = os.environ.get('BATCH_EXECUTOR', 'thread')  # 'thread' or 'process'
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', WORKER_CPU_SHARE))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+BATCH_IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp'}
+
+# Batched inference settings: concurrent requests for the same model are grouped
+# into one onnxruntime run of up to MAX_SIZE images, waiting at most MAX_WAIT_MS
+BATCH_INFERENCE_ENABLED = os.environ.get('BATCH_INFERENCE', '1') != '0'
+BATCH_INFERENCE_MAX_SIZE = int(os.environ.get('BATCH_INFERENCE_MAX_SIZE', 8))
+BATCH_INFERENCE_MAX_WAIT_MS = float(os.environ.get('BATCH_INFERENCE_MAX_WAIT_MS', 10))
+
+# Result cache settings (on-disk tier is disabled unless RESULT_CACHE_DIR is set)
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR')
+RESULT_CACHE_DISK_MAX_BYTES = int(os.environ.get('RESULT_CACHE_DISK_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+# Raw segmentation masks, keyed by (image hash, model), so post-processing tweaks skip the model
+MASK_CACHE_MAX_BYTES = int(os.environ.get('MASK_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+
+# Temp store settings: uploads saved for ComfyUI and the editor, named by content hash
+TEMP_DIR = os.environ.get('TEMP_DIR', 'temp')
+TEMP_TTL = int(os.environ.get('TEMP_TTL', 3600))  # seconds a file is kept after its last save
+TEMP_MAX_BYTES = int(os.environ.get('TEMP_MAX_BYTES', 1024 * 1024 * 1024))
+TEMP_SWEEP_INTERVAL = 60  # seconds between background TTL sweeps
+
+# Async job settings: queued jobs beyond JOB_QUEUE_MAX_DEPTH are rejected with 429
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_MAX_DEPTH = int(os.environ.get('JOB_QUEUE_MAX_DEPTH', 32))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 600))  # seconds finished jobs are kept
+
+# Memory bounds for large images. Uploads bigger than UPLOAD_SPOOL_BYTES are kept on disk,
+# images over MAX_IMAGE_PIXELS are rejected before decoding, and at most MAX_INFLIGHT_PIXELS
+# decoded pixels are processed at once (later requests wait up to ADMISSION_TIMEOUT seconds)
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 8 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 8192 * 8192))
+MAX_INFLIGHT_PIXELS = int(os.environ.get('MAX_INFLIGHT_PIXELS', 2 * 8192 * 8192))
+ADMISSION_TIMEOUT = float(os.environ.get('ADMISSION_TIMEOUT', 30))
+# Images whose estimated background removal peak exceeds REQUEST_MEMORY_BUDGET are segmented
+# on a proxy downscaled to SEGMENTATION_PROXY_MAX_SIDE and the mask is upscaled to full size.
+# Alpha matting keeps several float64 planes per pixel, hence the rough per-pixel estimate.
+REQUEST_MEMORY_BUDGET = int(os.environ.get('REQUEST_MEMORY_BUDGET', 1024 * 1024 * 1024))
+SEGMENTATION_PROXY_MAX_SIDE = int(os.environ.get('SEGMENTATION_PROXY_MAX_SIDE', 2048))
+MATTING_BYTES_PER_PIXEL = 200  # measured peak of rembg alpha matting, ~190 bytes per pixel
+
+# Output encoding: PNG unless a request asks for WebP (format=webp or an Accept header
+# preferring image/webp). PNG_COMPRESS_LEVEL trades size for speed (0-9; zlib's default is 6,
+# 1 encodes several times faster). WebP keeps alpha and is lossless unless a quality is given.
+PNG_COMPRESS_LEVEL = int(os.environ.get('PNG_COMPRESS_LEVEL', 6))
+WEBP_METHOD = int(os.environ.get('WEBP_METHOD', 4))  # 0 (fastest) to 6 (smallest)
+OUTPUT_MIMETYPES = {'png': 'image/png', 'webp': 'image/webp'}
+
+# High-resolution mode (settings 'high_res'): segment on a proxy of at most HIGH_RES_PROXY_SIDE,
+# then run closed-form alpha matting only in tiles that contain the mask edge, in parallel
+HIGH_RES_PROXY_SIDE = int(os.environ.get('HIGH_RES_PROXY_SIDE', 1024))
+HIGH_RES_TILE_SIZE = int(os.environ.get('HIGH_RES_TILE_SIZE', 256))
+HIGH_RES_TILE_MARGIN = 16  # pixels of context solved around each tile and then discarded
+HIGH_RES_WORKERS = int(os.environ.get('HIGH_RES_WORKERS', WORKER_CPU_SHARE))
+
+# Model input normalization (mean, std, input size), matching rembg's session classes
+MODEL_INPUT_SPECS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+}
+
+# Observability: per-stage timings go to the /metrics histograms and, per request, to the log
+# (logger 'app', INFO). SERVER_TIMING=1 also returns them in a Server-Timing response header.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Resampling filters accepted by fit_to_canvas, /resize-image and process_image's resize.
+# 'lanczos' (the default) resamples with PIL; the OpenCV filters are faster, and fit_to_canvas
+# resamples with them straight into the output canvas.
+RESAMPLE_FILTERS = {
+    'lanczos': None,
+    'area': cv2.INTER_AREA,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+    'nearest': cv2.INTER_NEAREST,
+}
+
+# Resize engine (scale_image): sources of at least PARALLEL_MIN_PIXELS are resampled in strips
+# on RESIZE_WORKERS threads, with the same output as one pass. Setting RESIZE_REDUCING_GAP makes
+# the resize steps (not fit_to_canvas) shrink large downscales by an integer factor with a box
+# filter first: faster, but no longer pixel-identical to a plain resize. 0 (default) disables it.
+RESIZE_REDUCING_GAP = float(os.environ.get('RESIZE_REDUCING_GAP', 0))
+RESIZE_WORKERS = int(os.environ.get('RESIZE_WORKERS', WORKER_CPU_SHARE))
+RESIZE_PARALLEL_MIN_PIXELS = int(os.environ.get('RESIZE_PARALLEL_MIN_PIXELS', 2_000_000))
+
+# Multi-size output (settings 'outputs'): at most MAX_OUTPUTS sizes/formats per request,
+# scaled one from another and encoded in parallel on the resize workers
+MAX_OUTPUTS = int(os.environ.get('MAX_OUTPUTS', 16))
+
+class MetricsRegistry:
+    """Counters and histograms rendered in the Prometheus text format.
+    Metrics are declared once with describe() and then updated by name with a dict of labels.
+    """
+
+    def __init__(self, prefix='bgremover', buckets=METRICS_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._types = {}  # name -> (type, help)
+        self._values = {}  # (name, labels) -> counter value or histogram [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def describe(self, name, metric_type, help_text):
+        self._types[name] = (metric_type, help_text)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+    def render(self):
+        with self._lock:
+            # Snapshot, copying histogram bucket lists so rendering happens outside the lock
+            values = [(key, (list(value[0]), value[1], value[2]) if isinstance(value, list) else value)
+                      for key, value in sorted(self._values.items(), key=lambda item: item[0])]
+
+        lines = []
+        for name, (metric_type, help_text) in self._types.items():
+            full_name = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for (metric, labels), value in values:
+                if metric != name:
+                    continue
+                if metric_type == 'histogram':
+                    counts, total, count = value
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(f"{full_name}_bucket{self.format_labels(labels + (('le', bound),))} {bucket_count}")
+                    lines.append(f"{full_name}_bucket{self.format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{full_name}_sum{self.format_labels(labels)} {total}")
+                    lines.append(f"{full_name}_count{self.format_labels(labels)} {count}")
+                else:
+                    lines.append(f"{full_name}{self.format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics_registry = MetricsRegistry()
+metrics_registry.describe('stage_seconds', 'histogram',
+                          'Time spent in each processing stage, by model where one applies')
+metrics_registry.describe('requests_total', 'counter', 'HTTP requests by endpoint and status code')
+metrics_registry.describe('request_seconds', 'histogram', 'HTTP request handling time by endpoint')
+metrics_registry.describe('images_processed_total', 'counter', 'Images run through process_image, by model')
+metrics_registry.describe('mask_cache_hits_total', 'counter', 'Segmentations answered from the mask cache, by model')
+metrics_registry.describe('comfyui_request_seconds', 'histogram', 'Time per ComfyUI API call by endpoint')
+
+# Stage timings of the request being handled on this thread, or None outside a request
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+def record_stage(stage, seconds, model=None):
+    """Record a stage duration in the stage_seconds histogram and the current request's timings"""
+    metrics_registry.observe('stage_seconds', {'stage': stage, 'model': model or ''}, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+@contextmanager
+def timed(stage, model=None):
+    """Time the enclosed block as a processing stage (see record_stage)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, model)
+
+def alpha_bounds(alpha):
+    """Return (bbox, has_transparency) for a 2D uint8 alpha array.
+    bbox is (left, top, right, bottom) of the non-transparent pixels, or None if there are none.
+    Opaque images are settled by a single min() scan; otherwise rows are reduced over the full
+    frame and columns only within the content rows.
+    """
+    height, width = alpha.shape
+    if alpha.min() == 255:
+        return (0, 0, width, height), False
+
+    rows = np.flatnonzero(alpha.max(axis=1))
+    if rows.size == 0:
+        return None, True
+    top, bottom = int(rows[0]), int(rows[-1]) + 1
+    cols = np.flatnonzero(alpha[top:bottom].max(axis=0))
+    return (int(cols[0]), top, int(cols[-1]) + 1, bottom), True
+
+def resample_into(image, box, dst, resample):
+    """Resample the box region of an RGBA image into dst, an (h, w, 4) view of the output canvas.
+    Colors are premultiplied by alpha while resampling, as PIL does, so transparent pixels
+    don't bleed into the edges.
+    """
+    left, top, right, bottom = box
+    region = np.asarray(image)[top:bottom, left:right]
+    premultiplied = cv2.cvtColor(region, cv2.COLOR_RGBA2mRGBA)
+    dst_height, dst_width = dst.shape[:2]
+    cv2.resize(premultiplied, (dst_width, dst_height), dst=dst, interpolation=RESAMPLE_FILTERS[resample])
+    cv2.cvtColor(dst, cv2.COLOR_mRGBA2RGBA, dst=dst)
+
+def target_size(size, width=None, height=None, maintain_aspect_ratio=True):
+    """Output size for resizing an image of size (w, h) to the requested width and/or height.
+    With maintain_aspect_ratio the image fits within the given dimensions (the more constraining
+    one wins when both are set); otherwise missing dimensions keep their original value.
+    """
+    current_width, current_height = size
+    if not maintain_aspect_ratio:
+        return width or current_width, height or current_height
+    if width and (not height or width * current_height <= height * current_width):
+        return width, max(1, round(current_height * width / current_width))
+    return max(1, round(current_width * height / current_height)), height
+
+_resize_executor = None
+_resize_executor_lock = threading.Lock()
+
+def get_resize_executor():
+    """Return the shared executor that resamples image strips, creating it on first use.
+    PIL's resampling, reduce and convert release the GIL, so threads use all cores."""
+    global _resize_executor
+    with _resize_executor_lock:
+        if _resize_executor is None:
+            _resize_executor = ThreadPoolExecutor(max_workers=RESIZE_WORKERS, thread_name_prefix='resize')
+        return _resize_executor
+
+def split_range(total, parts, align=1):
+    """Split range(total) into up to parts (start, stop) spans whose boundaries are multiples of align"""
+    units = -(-total // align)
+    parts = max(1, min(parts, units))
+    return [(min(total, units * i // parts * align), min(total, units * (i + 1) // parts * align))
+            for i in range(parts)]
+
+def map_strips(fn, image, size, parts, axis, align=1):
+    """Apply fn to strips of image, rows (axis 1) or columns (axis 0), and join the results into
+    a new image of size. fn must map a strip of n rows (columns) to n / align of them, rounded up."""
+    if parts <= 1:
+        return fn(image)
+    spans = split_range(image.size[axis], parts, align)
+    boxes = [(0, start, image.width, stop) if axis else (start, 0, stop, image.height) for start, stop in spans]
+    results = list(get_resize_executor().map(lambda box: fn(image.crop(box)), boxes))
+    output = Image.new(results[0].mode, size)
+    for (start, _), strip in zip(spans, results):
+        output.paste(strip, (0, start // align) if axis else (start // align, 0))
+    return output
+
+def scale_image(image, size, resample='lanczos', reducing_gap=None):
+    """Resize image to size with one of RESAMPLE_FILTERS. This is the resize engine behind
+    process_image, /resize-image and fit_to_canvas.
+
+    'lanczos' output is identical to PIL's resize(size, LANCZOS), which resamples RGBA through
+    premultiplied RGBa; for large images its passes run in parallel strips that split each pass
+    along the axis it doesn't resample. The OpenCV filters premultiply RGBA the same way.
+    With reducing_gap, downscales by more than that ratio first shrink by an integer factor with
+    a box filter (PIL's reducing_gap, which PIL itself ignores for RGBA), so the output is only
+    close to a plain resize.
+    """
+    if resample not in RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown resample filter: {resample}")
+    size = (int(size[0]), int(size[1]))
+    if size[0] < 1 or size[1] < 1:
+        raise ValueError(f"Invalid size: {size[0]}x{size[1]}")
+    if image.mode in ('P', 'PA', 'LA', 'La', '1'):
+        image = image.convert('RGBA' if image.mode != '1' else 'L')
+    if image.size == size:
+        return image.copy()
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        # Wide and multi-band integer modes: plain PIL, which handles them all
+        return image.resize(size, Image.Resampling.LANCZOS if resample == 'lanczos' else Image.Resampling.BICUBIC)
+
+    if RESAMPLE_FILTERS[resample] is not None:
+        return _scale_image_cv2(image, size, RESAMPLE_FILTERS[resample], reducing_gap)
+
+    parts = RESIZE_WORKERS if image.width * image.height >= RESIZE_PARALLEL_MIN_PIXELS else 1
+    premultiplied = image.mode == 'RGBA'
+    if premultiplied:
+        image = map_strips(lambda strip: strip.convert('RGBa'), image, image.size, parts, axis=1)
+
+    # Same integer reduction PIL's reducing_gap applies; strips are aligned to the factor
+    # so each block is reduced exactly as in one pass
+    box_width, box_height = image.size
+    if reducing_gap:
+        factor_x = int(image.width / size[0] / reducing_gap) or 1
+        factor_y = int(image.height / size[1] / reducing_gap) or 1
+        if factor_x > 1 or factor_y > 1:
+            reduced_size = (-(-image.width // factor_x), -(-image.height // factor_y))
+            image = map_strips(lambda strip: strip.reduce((factor_x, factor_y)), image, reduced_size,
+                               parts, axis=1, align=factor_y)
+            box_width, box_height = box_width / factor_x, box_height / factor_y
+
+    # The horizontal pass runs over row strips and the vertical pass over column strips, since
+    # each pass's coefficients depend only on the axis it resamples. PIL's pass order is kept:
+    # horizontal first, except for very tall images that shrink vertically
+    lanczos = Image.Resampling.LANCZOS
+
+    def horizontal(image):
+        if (size[0], box_width) == (image.width, image.width):
+            return image
+        return map_strips(lambda strip: strip.resize((size[0], strip.height), lanczos,
+                                                     box=(0, 0, box_width, strip.height)),
+                          image, (size[0], image.height), parts, axis=1)
+
+    def vertical(image):
+        if (size[1], box_height) == (image.height, image.height):
+            return image
+        return map_strips(lambda strip: strip.resize((strip.width, size[1]), lanczos,
+                                                     box=(0, 0, strip.width, box_height)),
+                          image, (image.width, size[1]), parts, axis=0)
+
+    if image.height > image.width * 100 and size[1] < image.height:
+        image = horizontal(vertical(image))
+    else:
+        image = vertical(horizontal(image))
+
+    if premultiplied:
+        image = map_strips(lambda strip: strip.convert('RGBA'), image, size, parts, axis=1)
+    return image
+
+def _scale_image_cv2(image, size, interpolation, reducing_gap=None):
+    """scale_image with an OpenCV filter; OpenCV parallelizes the resize itself"""
+    pixels = np.asarray(image)
+    premultiplied = image.mode == 'RGBA' and interpolation != cv2.INTER_NEAREST
+    if premultiplied:
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_RGBA2mRGBA)
+    if reducing_gap and interpolation in (cv2.INTER_LINEAR, cv2.INTER_CUBIC):
+        # Linear and cubic only sample a few source pixels per output pixel and alias on large
+        # downscales, so average down by an integer factor first
+        factor = int(min(image.width / size[0], image.height / size[1]) / reducing_gap)
+        if factor > 1:
+            pixels = cv2.resize(pixels, (-(-image.width // factor), -(-image.height // factor)),
+                                interpolation=cv2.INTER_AREA)
+    pixels = cv2.resize(pixels, size, interpolation=interpolation)
+    if premultiplied:
+        cv2.cvtColor(pixels, cv2.COLOR_mRGBA2RGBA, dst=pixels)
+    return Image.fromarray(pixels, image.mode)
+
+def scale_cascade(image, sizes, resample='lanczos', reducing_gap=None):
+    """Resize image to each of sizes, mipmap-style: largest first, each derived from the
+    smallest image produced so far that covers it in both dimensions (or image itself).
+    Repeated sizes share one image. Returns the images in the order of sizes."""
+    produced = {}
+    sources = [image]  # by decreasing area, so the last one that covers a size is the closest
+    for size in sorted(set(sizes), key=lambda s: s[0] * s[1], reverse=True):
+        source = next((s for s in reversed(sources) if s.width >= size[0] and s.height >= size[1]), image)
+        produced[size] = scale_image(source, size, resample, reducing_gap)
+        sources.append(produced[size])
+    return [produced[size] for size in sizes]
+
+def fit_to_canvas(image, padding_percent, resample='lanczos'):
     """Fits image within the existing canvas with specified padding percentage.
     padding_percent: 0 means image extends to canvas edges, 50 means 25% padding on each side
     The canvas size stays constant - the image is scaled to create the padding effect.
     For background-removed images, considers the actual content bounds.
+    resample: one of RESAMPLE_FILTERS
     """
+    if resample not in RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown resample filter: {resample}")
+
     # Convert to RGBA if not already
     if image.mode != 'RGBA':
         image = image.convert('RGBA')
     
-    # If padding is 0, return the original image
-    if padding_percent == 0:
-        # For transparent images, we need to scale content to canvas edges
-        alpha = image.getchannel('A')
-        bbox = alpha.getbbox()  # Returns (left, top, right, bottom)
-        if bbox:  # If there is non-transparent content
-            # Calculate content dimensions
-            content_width = bbox[2] - bbox[0]
-            content_height = bbox[3] - bbox[1]
-            canvas_width, canvas_height = image.size
-            
-            # Calculate scale to fit content to canvas edges
-            width_ratio = canvas_width / content_width
-            height_ratio = canvas_height / content_height
-            scale = min(width_ratio, height_ratio)
-            
-            # Calculate final dimensions
-            final_width = int(content_width * scale)
-            final_height = int(content_height * scale)
-            
-            # Create new image with original canvas dimensions
-            new_image = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
-            
-            # Extract and scale content
-            content = image.crop(bbox)
-            resized_content = content.resize((final_width, final_height), Image.Resampling.LANCZOS)
-            
-            # Center the content
-            paste_x = (canvas_width - final_width) // 2
-            paste_y = (canvas_height - final_height) // 2
-            
-            # Paste the resized content
-            new_image.paste(resized_content, (paste_x, paste_y))
-            return new_image
-            
-        return image
-    
     # Get canvas dimensions (original image dimensions)
     canvas_width, canvas_height = image.size
     
-    # Check if image has transparency by looking at alpha channel
-    alpha = image.getchannel('A')
-    has_transparency = alpha.getextrema()[0] < 255  # True if any pixel is not fully opaque
+    # Content bounds and transparency check from one view of the alpha channel
+    bbox, has_transparency = alpha_bounds(np.asarray(image.getchannel('A')))
+    if bbox is None:  # Image is completely transparent
+        return image
     
-    if has_transparency:
-        # For background-removed images, use content bounds
-        bbox = alpha.getbbox()  # Returns (left, top, right, bottom)
-        if bbox is None:  # Image is completely transparent
-            return image
-            
-        # Calculate content dimensions
-        content_width = bbox[2] - bbox[0]
-        content_height = bbox[3] - bbox[1]
-        
-        # Calculate the target size based on padding percentage
-        # padding_percent of 50 means the content should take up 50% of the canvas
+    if padding_percent == 0 or has_transparency:
+        # Scale the content bounds to fit within the target size, maintaining aspect ratio.
+        # padding_percent of 50 means the content should take up 50% of the canvas; with 0
+        # the content is scaled to the canvas edges.
         target_width = int(canvas_width * (1 - padding_percent / 100))
         target_height = int(canvas_height * (1 - padding_percent / 100))
-        
-        # Calculate scale ratios to fit content within target size while maintaining aspect ratio
-        width_ratio = target_width / content_width
-        height_ratio = target_height / content_height
-        scale = min(width_ratio, height_ratio)
-        
-        # Calculate final dimensions
+        content_width = bbox[2] - bbox[0]
+        content_height = bbox[3] - bbox[1]
+        scale = min(target_width / content_width, target_height / content_height)
         final_width = int(content_width * scale)
         final_height = int(content_height * scale)
-        
-        # Create new image with original canvas dimensions and transparent background
-        new_image = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
-        
-        # Extract content using bbox and resize it
-        content = image.crop(bbox)
-        resized_content = content.resize((final_width, final_height), Image.Resampling.LANCZOS)
-        
-        # Calculate paste position to center the content
-        paste_x = (canvas_width - final_width) // 2
-        paste_y = (canvas_height - final_height) // 2
-        
-        # Paste the resized content
-        new_image.paste(resized_content, (paste_x, paste_y))
-        
-        return new_image
     else:
         # For regular images, use the original padding behavior
-        # Calculate the target size based on padding percentage
-        target_width = int(canvas_width * (1 - padding_percent / 100))
-        target_height = int(canvas_height * (1 - padding_percent / 100))
-        
-        # Create new image with original dimensions and transparent background
+        final_width = int(canvas_width * (1 - padding_percent / 100))
+        final_height = int(canvas_height * (1 - padding_percent / 100))
+    
+    if (final_width, final_height) == (canvas_width, canvas_height) and bbox == (0, 0, canvas_width, canvas_height):
+        # Content already fills the canvas
+        return image
+    
+    # Calculate paste position to center the content
+    paste_x = (canvas_width - final_width) // 2
+    paste_y = (canvas_height - final_height) // 2
+    
+    if RESAMPLE_FILTERS[resample] is None:
+        # Crop first, so the premultiply pass is limited to the content bounds. No reducing gap:
+        # the result stays identical to a plain LANCZOS resize of the content
+        resized_content = scale_image(image.crop(bbox), (final_width, final_height))
+        if (final_width, final_height) == (canvas_width, canvas_height):
+            return resized_content
         new_image = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
-        
-        # Resize the original image
-        resized_content = image.resize((target_width, target_height), Image.Resampling.LANCZOS)
-        
-        # Calculate paste position to center the content
-        paste_x = (canvas_width - target_width) // 2
-        paste_y = (canvas_height - target_height) // 2
-        
-        # Paste the resized content
         new_image.paste(resized_content, (paste_x, paste_y))
-        
         return new_image
+    
+    # Resample directly into a preallocated transparent canvas
+    canvas = np.zeros((canvas_height, canvas_width, 4), dtype=np.uint8)
+    resample_into(image, bbox, canvas[paste_y:paste_y + final_height, paste_x:paste_x + final_width], resample)
+    return Image.fromarray(canvas, 'RGBA')
 
-# Initialize with default model
-session = new_session("u2net")
+# rembg imports onnxruntime, scipy and numba (via pymatting), which takes seconds, so it is
+# imported on first use; importing this module stays fast for tests, tools and the CLI.
+def rembg_new_session(*args, **kwargs):
+    from rembg import new_session
+    return new_session(*args, **kwargs)
 
-def load_workflow(workflow_file):
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL',
+}
+EXECUTION_MODES = {'sequential': 'ORT_SEQUENTIAL', 'parallel': 'ORT_PARALLEL'}
+
+def model_options(model_name):
+    """Effective onnxruntime settings for model_name: the ORT_* defaults with any
+    ORT_MODEL_OPTIONS overrides applied"""
+    options = {
+        'intra_op_threads': ORT_INTRA_OP_THREADS,
+        'inter_op_threads': ORT_INTER_OP_THREADS,
+        'execution_mode': ORT_EXECUTION_MODE,
+        'graph_optimization': ORT_GRAPH_OPTIMIZATION,
+        'cpu_mem_arena': ORT_CPU_MEM_ARENA,
+        'mem_pattern': ORT_MEM_PATTERN,
+        'allow_spinning': ORT_ALLOW_SPINNING,
+        'optimized_model_dir': ORT_OPTIMIZED_MODEL_DIR,
+    }
+    overrides = ORT_MODEL_OPTIONS.get(model_name, {})
+    unknown = set(overrides) - set(options)
+    if unknown:
+        raise ValueError(f"Unknown onnxruntime options for {model_name}: {', '.join(sorted(unknown))}")
+    options.update(overrides)
+
+    if options['execution_mode'] not in EXECUTION_MODES:
+        raise ValueError(f"execution_mode must be one of: {', '.join(EXECUTION_MODES)}")
+    if options['graph_optimization'] not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"graph_optimization must be one of: {', '.join(GRAPH_OPTIMIZATION_LEVELS)}")
+    if not options['intra_op_threads']:
+        # Split the cores between the runs that execute at once
+        options['intra_op_threads'] = max(1, (os.cpu_count() or 1) // max(1, INFERENCE_CONCURRENCY))
+    return options
+
+def optimized_model_path(model_name, options):
+    """Where the optimized graph for model_name is saved, or None if that's disabled"""
+    import onnxruntime as ort
+    if not options['optimized_model_dir'] or options['graph_optimization'] == 'disable':
+        return None
+    # Optimized graphs depend on the level and the onnxruntime build that produced them
+    return (Path(options['optimized_model_dir'])
+            / f"{model_name}.{options['graph_optimization']}.ort-{ort.__version__}.onnx")
+
+def session_options(options, optimized_path=None):
+    """onnxruntime.SessionOptions for the given settings. If optimized_path exists the saved graph
+    is loaded as-is; otherwise the optimized graph is written there for next time."""
+    import onnxruntime as ort
+    sess_opts = ort.SessionOptions()
+    sess_opts.intra_op_num_threads = options['intra_op_threads']
+    sess_opts.inter_op_num_threads = options['inter_op_threads']
+    sess_opts.execution_mode = getattr(ort.ExecutionMode, EXECUTION_MODES[options['execution_mode']])
+    sess_opts.enable_cpu_mem_arena = options['cpu_mem_arena']
+    sess_opts.enable_mem_pattern = options['mem_pattern']
+    sess_opts.add_session_config_entry('session.intra_op.allow_spinning',
+                                       '1' if options['allow_spinning'] else '0')
+
+    level = GRAPH_OPTIMIZATION_LEVELS[options['graph_optimization']]
+    if optimized_path is not None and optimized_path.exists():
+        level = 'ORT_DISABLE_ALL'
+    elif optimized_path is not None:
+        optimized_path.parent.mkdir(parents=True, exist_ok=True)
+        sess_opts.optimized_model_filepath = str(optimized_path)
+    sess_opts.graph_optimization_level = getattr(ort.GraphOptimizationLevel, level)
+    return sess_opts
+
+def create_session(model_name):
+    """New rembg session for model_name using its onnxruntime settings (see model_options)"""
+    options = model_options(model_name)
+    optimized_path = optimized_model_path(model_name, options)
+    sess_opts = session_options(options, optimized_path)
+    logger.debug("onnxruntime options for %s: %s", model_name, options)
+
+    if optimized_path is None or not optimized_path.exists():
+        return rembg_new_session(model_name, sess_opts=sess_opts)
+
+    # rembg always loads the model it downloaded, so point a subclass at the saved graph instead
+    from rembg.sessions import sessions_class
+    session_class = next(sc for sc in sessions_class if sc.name() == model_name)
+
+    class OptimizedSession(session_class):
+        @classmethod
+        def download_models(cls, *args, **kwargs):
+            return str(optimized_path)
+
+    return OptimizedSession(model_name, sess_opts)
+
+def remove(*args, **kwargs):
+    """rembg.remove, imported on first use"""
+    from rembg import remove as rembg_remove
+    return rembg_remove(*args, **kwargs)
+
+class SessionPool:
+    """Thread-safe LRU pool of rembg sessions keyed by model name.
+    Sessions are created on first use; once more than max_size models are
+    loaded, the least recently used session other than the default is dropped
+    (the default too when the pool only has room for the model just loaded).
+    The default model name lives in shared memory, so when the app is imported
+    before forking (gunicorn's preload_app) a switch applies to every worker.
+    """
+
+    def __init__(self, max_size=SESSION_POOL_SIZE, default_model=DEFAULT_MODEL):
+        self.max_size = max(1, int(max_size))
+        self._default = multiprocessing.Array('c', 64)
+        self._default.value = default_model.encode()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # model name -> lock held while that model loads
+
+    @property
+    def default_model(self):
+        with self._default.get_lock():
+            return self._default.value.decode()
+
+    def _cached(self, model_name):
+        # Caller must hold self._lock
+        session = self._sessions.get(model_name)
+        if session is not None:
+            self._sessions.move_to_end(model_name)
+        return session
+
+    def get(self, model_name=None):
+        """Return the session for model_name (default model if None), loading it if needed"""
+        model_name = model_name or self.default_model
+        if model_name not in AVAILABLE_MODELS:
+            raise ValueError(f"Unknown model: {model_name}")
+
+        with self._lock:
+            session = self._cached(model_name)
+            if session is not None:
+                return session
+            load_lock = self._loading.setdefault(model_name, threading.Lock())
+
+        # Load outside the pool lock so requests for other models aren't blocked,
+        # while concurrent requests for the same model wait for a single load
+        with load_lock:
+            with self._lock:
+                session = self._cached(model_name)
+                if session is not None:
+                    return session
+
+            logger.info("Loading rembg session for model: %s", model_name)
+            session = create_session(model_name)
+
+            with self._lock:
+                self._sessions[model_name] = session
+                self._loading.pop(model_name, None)
+                default_model = self.default_model
+                while len(self._sessions) > self.max_size:
+                    # Least recently used first; the default only goes when nothing else can,
+                    # and the session just loaded never does
+                    evicted = next((name for name in self._sessions if name not in (default_model, model_name)),
+                                   None) or next(name for name in self._sessions if name != model_name)
+                    del self._sessions[evicted]
+                    logger.info("Evicted rembg session for model: %s", evicted)
+            return session
+
+    def set_default(self, model_name):
+        """Make model_name the default model, loading its session up front. Other
+        processes sharing the default load it on their next request."""
+        if model_name not in AVAILABLE_MODELS:
+            raise ValueError(f"Unknown model: {model_name}")
+        self.get(model_name)
+        with self._default.get_lock():
+            self._default.value = model_name.encode()
+
+    def loaded_models(self):
+        with self._lock:
+            return list(self._sessions)
+
+session_pool = SessionPool()
+
+class ModelPreloader:
+    """Loads models into the session pool on a background thread so startup isn't blocked,
+    and tracks which are still pending or failed for the readiness check"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.pending = []
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def start(self, model_names):
+        with self._lock:
+            new = [m for m in model_names if m not in self.pending]
+            self.pending.extend(new)
+            for model_name in new:
+                self.errors.pop(model_name, None)
+        if new:
+            threading.Thread(target=self._run, args=(new,), name='model-preload', daemon=True).start()
+
+    def _run(self, model_names):
+        start = time.perf_counter()
+        for model_name in model_names:
+            try:
+                self.pool.get(model_name)
+            except Exception as e:
+                logger.error(f"Failed to preload model {model_name}: {e}")
+                with self._lock:
+                    self.errors[model_name] = str(e)
+            finally:
+                with self._lock:
+                    self.pending.remove(model_name)
+        logger.info("Preloaded %s in %.1fs", ', '.join(model_names), time.perf_counter() - start)
+
+    def status(self):
+        with self._lock:
+            return {
+                'ready': not self.pending and not self.errors,
+                'pending': list(self.pending),
+                'failed': dict(self.errors),
+                'loaded': self.pool.loaded_models(),
+            }
+
+model_preloader = ModelPreloader(session_pool)
+if PRELOAD_MODELS:
+    if len(PRELOAD_MODELS) > session_pool.max_size:
+        logger.warning("Preloading %d models into a pool of size %d", len(PRELOAD_MODELS), session_pool.max_size)
+    model_preloader.start(PRELOAD_MODELS)
+
+class InferenceBatcher:
+    """Groups concurrent mask predictions for the same model into batched onnxruntime runs.
+    Callers preprocess and postprocess on their own threads; one worker thread per model
+    only stacks the input tensors, runs the network once and hands each caller its slice.
+    """
+
+    def __init__(self, pool, max_batch_size=BATCH_INFERENCE_MAX_SIZE, max_wait_ms=BATCH_INFERENCE_MAX_WAIT_MS):
+        self.pool = pool
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait_ms / 1000
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._unbatchable = set()  # models whose graph only accepts a batch of 1
+
+    def _queue_for(self, model_name):
+        with self._lock:
+            if model_name not in self._queues:
+                self._queues[model_name] = queue.Queue()
+                threading.Thread(target=self._worker, args=(model_name,),
+                                 name=f'batcher-{model_name}', daemon=True).start()
+            return self._queues[model_name]
+
+    def predict(self, model_name, img):
+        """Return the model's mask for img as an 'L' image of the same size"""
+        session = self.pool.get(model_name)
+        mean, std, size = MODEL_INPUT_SPECS[model_name]
+        inputs = session.normalize(img, mean, std, size)
+        tensor = next(iter(inputs.values()))
+
+        future = Future()
+        self._queue_for(model_name).put((tensor, future))
+        pred = future.result()
+
+        # Same postprocessing as rembg's sessions, per image
+        ma, mi = np.max(pred), np.min(pred)
+        pred = (pred - mi) / max(ma - mi, 1e-6)
+        mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+        return mask.resize(img.size, Image.Resampling.LANCZOS)
+
+    def _collect(self, q):
+        # Block for the first request, then gather more until the batch is full or the wait expires
+        batch = [q.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self, model_name):
+        q = self._queues[model_name]
+        while True:
+            batch = self._collect(q)
+            try:
+                preds = self._run(model_name, [tensor for tensor, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), pred in zip(batch, preds):
+                future.set_result(pred)
+
+    def _run(self, model_name, tensors):
+        session = self.pool.get(model_name).inner_session
+        input_name = session.get_inputs()[0].name
+
+        if len(tensors) > 1 and model_name not in self._unbatchable:
+            try:
+                outputs = session.run(None, {input_name: np.concatenate(tensors, axis=0)})
+                return list(outputs[0][:, 0, :, :])
+            except Exception as e:
+                # Some exported graphs have the batch dimension fixed to 1; stop batching those.
+                # Anything else (e.g. running out of memory) only falls back for this batch
+                if is_batch_dimension_error(e):
+                    logger.warning("Model %s doesn't accept batches, running its inputs one at a time: %s",
+                                   model_name, e)
+                    self._unbatchable.add(model_name)
+                else:
+                    logger.warning("Batched inference failed for %s, falling back to single runs: %s",
+                                   model_name, e)
+
+        return [session.run(None, {input_name: tensor})[0][0, 0, :, :] for tensor in tensors]
+
+def is_batch_dimension_error(e):
+    """Whether onnxruntime rejected an input for its dimensions (InvalidArgument), as graphs
+    exported with a fixed batch size of 1 do for batched input"""
+    return type(e).__name__ == 'InvalidArgument' and 'dimension' in str(e).lower()
+
+class BatchedSession:
+    """Stand-in for a rembg session whose predict() goes through the InferenceBatcher"""
+
+    def __init__(self, batcher, model_name):
+        self.batcher = batcher
+        self.model_name = model_name
+
+    def predict(self, img, *args, **kwargs):
+        return [self.batcher.predict(self.model_name, img)]
+
+inference_batcher = InferenceBatcher(session_pool)
+
+def get_session(model_name=None, image_hash=None):
+    """Return the session process_image should use for model_name.
+    image_hash identifies the input for the mask cache; it's computed from the pixels if omitted.
+    """
+    model_name = model_name or session_pool.default_model
+    with timed('session', model_name):
+        if BATCH_INFERENCE_ENABLED and model_name in MODEL_INPUT_SPECS:
+            session = BatchedSession(inference_batcher, model_name)
+        else:
+            session = session_pool.get(model_name)
+    return CachedMaskSession(session, model_name, image_hash)
+
+class ResultCache:
+    """Content-addressed cache of encoded endpoint results (and raw masks, see mask_cache).
+    Keys hash the input bytes together with the normalized parameters. Entries live in an
+    in-memory LRU bounded by total bytes, with an optional on-disk tier (also size-bounded)
+    that survives restarts and is promoted back into memory on a hit.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, disk_dir=RESULT_CACHE_DIR,
+                 disk_max_bytes=RESULT_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'disk_evictions': 0}
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(f.stat().st_size for f in self.disk_dir.glob('*/*') if f.is_file())
+
+    @staticmethod
+    def make_key(endpoint, data_hash, params):
+        """Hash of the endpoint name, input hash (see hash_stream) and parameters (order-independent)"""
+        digest = hashlib.sha256()
+        digest.update(endpoint.encode())
+        digest.update(data_hash.encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return self.disk_dir / key[:2] / key
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return self._entries[key]
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)  # mtime doubles as last-access time for eviction
+            except OSError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self.counters['disk_hits'] += 1
+                self._put_memory(key, data)
+                return data
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, key, data):
+        self._put_memory(key, data)
+        if self.disk_dir:
+            self._put_disk(key, data)
+
+    def _put_memory(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.counters['evictions'] += 1
+
+    def _put_disk(self, key, data):
+        path = self._disk_path(key)
+        if path.exists():
+            return
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Error writing result cache entry %s: %s", key, e)
+            return
+        with self._lock:
+            self._disk_bytes += len(data)
+            over_quota = self._disk_bytes > self.disk_max_bytes
+        if over_quota:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        # Drop least recently used files until the tier is back under 90% of its quota
+        files = sorted((f for f in self.disk_dir.glob('*/*') if f.is_file() and not f.name.endswith('.tmp')),
+                       key=lambda f: f.stat().st_mtime)
+        with self._lock:
+            target = self.disk_max_bytes * 0.9
+            for f in files:
+                if self._disk_bytes <= target:
+                    break
+                try:
+                    size = f.stat().st_size
+                    f.unlink()
+                except OSError:
+                    continue
+                self._disk_bytes -= size
+                self.counters['disk_evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            hits = lookups - self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._entries),
+                'memory_bytes': self._bytes,
+                'disk_bytes': self._disk_bytes if self.disk_dir else None,
+            }
+
+result_cache = ResultCache()
+mask_cache = ResultCache(max_bytes=MASK_CACHE_MAX_BYTES, disk_dir=None)
+
+class _HashingWriter:
+    """File-like wrapper that hashes everything written through it"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.fp.write(data)
+
+class TempStore:
+    """Directory of short-lived files named by a hash of their content, so identical
+    uploads are stored once and a name always refers to the same bytes. Files expire
+    ttl seconds after they were last saved; a background thread sweeps expired files
+    and, when the directory grows past max_bytes, the least recently saved ones.
+    """
+
+    def __init__(self, directory=TEMP_DIR, ttl=TEMP_TTL, max_bytes=TEMP_MAX_BYTES,
+                 sweep_interval=TEMP_SWEEP_INTERVAL):
+        self.directory = Path(directory).absolute()  # send_file would resolve it against the app's root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sweeper = None
+        self.counters = {'saves': 0, 'dedup_hits': 0, 'expired': 0, 'evictions': 0}
+
+    def _start(self):
+        # Started with the first save rather than at import, like the job queue's workers
+        with self._lock:
+            if self._sweeper is None:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._sweeper = threading.Thread(target=self._sweep_loop, name='temp-sweeper', daemon=True)
+                self._sweeper.start()
+
+    def path(self, name):
+        """Path of a stored file, or None if the name isn't one this store could have made"""
+        if not re.fullmatch(r'[0-9a-f]{32}(\.[a-z0-9]{1,5})?', name):
+            return None
+        return self.directory / name
+
+    def save(self, source, filename=''):
+        """Store the bytes of source, either a readable stream or a function that writes to
+        the file object it's given, and return the file's name. filename only supplies the
+        extension. Saving content that is already stored just renews its expiry."""
+        self._start()
+        suffix = Path(secure_filename(filename or '')).suffix.lower()
+        if not re.fullmatch(r'\.[a-z0-9]{1,5}', suffix):
+            suffix = ''
+
+        # A seekable stream (e.g. an upload) can be hashed first, so repeated content is never
+        # written again; a writer function or plain stream is hashed while it's written
+        if not callable(source) and getattr(source, 'seekable', lambda: False)():
+            start = source.tell()
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                digest.update(chunk)
+            name = digest.hexdigest()[:32] + suffix
+            if self._renew(name):
+                return name
+            source.seek(start)
+
+        tmp_path = self.directory / f".{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                writer = _HashingWriter(f)
+                if callable(source):
+                    source(writer)
+                else:
+                    shutil.copyfileobj(source, writer, 1024 * 1024)
+            name = writer.digest.hexdigest()[:32] + suffix
+            path = self.directory / name
+            if self._renew(name):
+                tmp_path.unlink()
+                return name
+            size = tmp_path.stat().st_size
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self.counters['saves'] += 1
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._wake.set()
+        return name
+
+    def _renew(self, name):
+        """Renew the expiry of an already stored file; returns False if there is none"""
+        try:
+            os.utime(self.directory / name)  # mtime is the last save, for expiry and eviction
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self.counters['dedup_hits'] += 1
+        return True
+
+    def _sweep_loop(self):
+        # The first sweep also picks up whatever an earlier run left behind
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Error sweeping temp files")
+            self._wake.wait(self.sweep_interval)
+            self._wake.clear()
+
+    def sweep(self):
+        """Delete expired files, then the least recently saved ones until the directory is
+        back under 90% of max_bytes. Other processes may share the directory, so it is
+        rescanned rather than tracked."""
+        now = time.time()
+        files = []
+        for f in self.directory.iterdir():
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            # Leave in-progress writes alone unless they were abandoned long ago
+            if f.name.endswith('.tmp') and now - stat.st_mtime < self.ttl:
+                continue
+            files.append((stat.st_mtime, stat.st_size, f))
+        files.sort(key=lambda entry: entry[0])
+
+        total = sum(size for _, size, _ in files)
+        expired = evicted = 0
+        for mtime, size, f in files:
+            is_expired = now - mtime > self.ttl
+            if not is_expired and total <= self.max_bytes * 0.9:
+                break
+            try:
+                f.unlink()
+            except OSError:
+                continue
+            total -= size
+            if is_expired:
+                expired += 1
+            else:
+                evicted += 1
+
+        with self._lock:
+            self._bytes = total
+            self.counters['expired'] += expired
+            self.counters['evictions'] += evicted
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'bytes': self._bytes}
+
+temp_store = TempStore()
+
+def image_digest(img):
+    """Hash of an image's decoded pixels, for callers that don't have the upload bytes"""
+    digest = hashlib.blake2b(f"{img.mode}:{img.size}".encode(), digest_size=20)
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+class CachedMaskSession:
+    """Wraps a session so its raw masks are cached per (image hash, model).
+    Changing only the matting, padding or resize settings then reuses the mask instead of
+    running the network again. predict_seconds accumulates the time spent in predict(), so
+    callers can tell inference apart from the rest of remove().
+    """
+
+    def __init__(self, session, model_name, image_hash=None):
+        self.session = session
+        self.model_name = model_name
+        self.image_hash = image_hash
+        self.predict_seconds = 0.0
+
+    def predict(self, img, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._predict(img, *args, **kwargs)
+        finally:
+            self.predict_seconds += time.perf_counter() - start
+
+    def _predict(self, img, *args, **kwargs):
+        if mask_cache.max_bytes <= 0:
+            # Caching disabled: don't hash the pixels for a key nobody will look up
+            with timed('inference', self.model_name):
+                return self.session.predict(img, *args, **kwargs)
+
+        # The size is part of the key since a proxy of the same upload may be segmented instead
+        key = f"{self.image_hash or image_digest(img)}:{self.model_name}:{img.size[0]}x{img.size[1]}"
+        data = mask_cache.get(key)
+        if data is not None:
+            metrics_registry.inc('mask_cache_hits_total', {'model': self.model_name})
+            return [Image.frombytes('L', img.size, data)]
+
+        with timed('inference', self.model_name):
+            masks = self.session.predict(img, *args, **kwargs)
+        # All supported models return a single mask the size of the input
+        if len(masks) == 1 and masks[0].mode == 'L' and masks[0].size == img.size:
+            mask_cache.put(key, masks[0].tobytes())
+        return masks
+
+def cached_image_response(endpoint, data_hash, params, render):
+    """Serve an image from the result cache, calling render() for the PIL image on a miss.
+    The output encoding is negotiated from the request (see output_encoding) and is part of
+    the cache key. The key doubles as a strong ETag, so a matching If-None-Match
+    short-circuits before any work is done. On a miss the image is encoded straight into
+    the response body.
+    """
+    encoding = output_encoding()
+    key = result_cache.make_key(endpoint, data_hash, dict(params, output=encoding))
+    mimetype = OUTPUT_MIMETYPES[encoding['format']]
+    if request.if_none_match.contains(key):
+        response = Response(status=304)
+        response.set_etag(key)
+        response.vary.add('Accept')
+        return response
+
+    body = result_cache.get(key)
+    if body is not None:
+        return image_response(body, key, 'HIT', mimetype)
+
+    response = image_response(None, key, 'MISS', mimetype)
+    encode_image(render(), response.stream, encoding)
+    result_cache.put(key, response.get_data())
+    return response
+
+def get_or_render(key, render):
+    """Return (body, was_cached) for key, rendering and caching it on a miss"""
+    body = result_cache.get(key)
+    if body is not None:
+        return body, True
+    body = render()
+    result_cache.put(key, body)
+    return body, False
+
+def image_response(body, etag, cache_status, mimetype='image/png'):
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Cache'] = cache_status
+    # The format may have been negotiated from the Accept header
+    response.vary.add('Accept')
+    return response
+
+class InvalidOutputEncoding(ValueError):
+    status_code = 400
+
+def output_encoding():
+    """The output encoding for the current request, from its format, compress_level and quality
+    parameters (form or query string), falling back to the Accept header. Returned as a dict
+    so it can be part of a cache key."""
+    fmt = request.values.get('format')
+    if not fmt:
+        # Only switch to WebP for clients that name it explicitly, e.g. browsers fetching <img>
+        accept = request.accept_mimetypes
+        named = {value for value, quality in accept}
+        fmt = 'webp' if 'image/webp' in named and accept['image/webp'] > 0 \
+            and accept['image/webp'] >= accept['image/png'] else 'png'
+    return make_encoding(fmt, request.values.get('compress_level'), request.values.get('quality'))
+
+def make_encoding(fmt, compress_level=None, quality=None):
+    """Validate an output format and its options into an encoding dict for encode_image"""
+    fmt = str(fmt).lower()
     try:
-        with open(workflow_file, 'r') as f:
-            workflow = json.load(f)
-            print(f"Loaded workflow from {workflow_file}")
-            print(f"Workflow contains {len(workflow)} nodes")
+        if fmt == 'png':
+            level = int(compress_level if compress_level is not None else PNG_COMPRESS_LEVEL)
+            if not 0 <= level <= 9:
+                raise ValueError
+            return {'format': 'png', 'compress_level': level}
+        if fmt == 'webp':
+            if quality is None:
+                return {'format': 'webp', 'lossless': True}
+            quality = int(quality)
+            if not 1 <= quality <= 100:
+                raise ValueError
+            return {'format': 'webp', 'quality': quality}
+    except (TypeError, ValueError):
+        raise InvalidOutputEncoding('compress_level must be 0-9 and quality 1-100')
+    raise InvalidOutputEncoding(f'Unsupported output format: {fmt}')
+
+def encode_image(image, fp, encoding):
+    """Encode image into the writable file object fp as described by an output_encoding() dict"""
+    with timed('encode'):
+        if encoding['format'] == 'webp':
+            if encoding.get('lossless'):
+                image.save(fp, format='WEBP', lossless=True, method=WEBP_METHOD)
+            else:
+                image.save(fp, format='WEBP', quality=encoding['quality'], method=WEBP_METHOD)
+        else:
+            image.save(fp, format='PNG', compress_level=encoding.get('compress_level', PNG_COMPRESS_LEVEL))
+
+def encode_bytes(image, encoding=None):
+    """encode_image into a bytes object; PNG at PNG_COMPRESS_LEVEL when no encoding is given"""
+    encoding = encoding or make_encoding('png')
+    buffer = BytesIO()
+    encode_image(image, buffer, encoding)
+    return buffer.getvalue()
+
+def parse_outputs(outputs, default_encoding=None):
+    """Validate the 'outputs' setting: a list of {width, height, maintain_aspect_ratio, format,
+    compress_level, quality, name}, each needing width and/or height. Returns normalized dicts
+    whose 'output' is the encoding (default_encoding, or PNG, when no format is given)."""
+    if not isinstance(outputs, list) or not outputs:
+        raise InvalidOutputEncoding('outputs must be a non-empty list')
+    if len(outputs) > MAX_OUTPUTS:
+        raise InvalidOutputEncoding(f'Too many outputs (max {MAX_OUTPUTS})')
+
+    parsed = []
+    for spec in outputs:
+        if not isinstance(spec, dict):
+            raise InvalidOutputEncoding('Each output must be an object')
+        try:
+            width = int(spec['width']) if spec.get('width') else None
+            height = int(spec['height']) if spec.get('height') else None
+        except (TypeError, ValueError):
+            raise InvalidOutputEncoding('Invalid output dimensions')
+        if (width is None and height is None) or (width or 1) < 1 or (height or 1) < 1:
+            raise InvalidOutputEncoding('Each output needs a positive width and/or height')
+        if spec.get('format'):
+            encoding = make_encoding(spec['format'], spec.get('compress_level'), spec.get('quality'))
+        else:
+            encoding = default_encoding or make_encoding('png')
+        parsed.append({
+            'width': width,
+            'height': height,
+            'maintain_aspect_ratio': bool(spec.get('maintain_aspect_ratio', True)),
+            'output': encoding,
+            'name': secure_filename(str(spec.get('name') or '')) or None,
+        })
+    return parsed
+
+def normalize_settings(settings):
+    """The subset of process_image settings that affects its output, with defaults filled in"""
+    normalized = {
+        'model': settings.get('model') or session_pool.default_model,
+        'foreground_threshold': settings.get('foreground_threshold'),
+        'erode_size': settings.get('erode_size'),
+        'border_size': settings.get('border_size', 0) if settings.get('border_enabled', False) else None,
+        'resample': settings.get('resample', 'lanczos')
+                    if settings.get('border_enabled', False) or settings.get('target_width') or settings.get('target_height')
+                    else None,
+        'target_width': settings.get('target_width') or None,
+        'target_height': settings.get('target_height') or None,
+        'segmentation_max_side': settings.get('segmentation_max_side') or None,
+        'high_res': bool(settings.get('high_res', False)),
+    }
+    if normalized['target_width'] or normalized['target_height']:
+        normalized['maintain_aspect_ratio'] = settings.get('maintain_aspect_ratio', True)
+    if settings.get('outputs'):
+        # Multi-size requests replace the single resize step with their cascade; the parsed
+        # outputs themselves are added to the key by the caller
+        normalized.update(target_width=None, target_height=None, maintain_aspect_ratio=None,
+                          resample=settings.get('resample', 'lanczos'))
+    return normalized
+
+class ImageTooLarge(ValueError):
+    status_code = 413
+
+class ServerBusy(Exception):
+    status_code = 503
+
+class PixelBudget:
+    """Global admission limit on the number of decoded pixels being processed at once.
+    Requests reserve their image's pixel count and wait (up to timeout seconds) while
+    others hold the budget, so a burst of huge uploads queues instead of exhausting memory.
+    """
+
+    def __init__(self, max_pixels=MAX_INFLIGHT_PIXELS, timeout=ADMISSION_TIMEOUT):
+        self.max_pixels = max_pixels
+        self.timeout = timeout
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, pixels):
+        # An image bigger than the whole budget still runs, just on its own
+        pixels = min(pixels, self.max_pixels)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_use + pixels <= self.max_pixels,
+                                       timeout=self.timeout):
+                raise ServerBusy('Server is busy with other large images, try again shortly')
+            self._in_use += pixels
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_use -= pixels
+                self._cond.notify_all()
+
+    def in_use(self):
+        with self._cond:
+            return self._in_use
+
+pixel_budget = PixelBudget()
+
+def hash_stream(fp):
+    """sha256 hex digest of a file object, read in chunks so spooled uploads stay on disk.
+    The stream is rewound afterwards."""
+    digest = hashlib.sha256()
+    with timed('hash'):
+        fp.seek(0)
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(chunk)
+        fp.seek(0)
+    return digest.hexdigest()
+
+def spool_stream(fp):
+    """Copy a file object into a temporary file that only spills to disk past UPLOAD_SPOOL_BYTES"""
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    fp.seek(0)
+    shutil.copyfileobj(fp, spool)
+    spool.seek(0)
+    return spool
+
+def open_image(fp):
+    """Open an image lazily, rejecting it from its header before any pixels are decoded
+    if it exceeds MAX_IMAGE_PIXELS"""
+    image = Image.open(fp)
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f'Image is {width}x{height}; at most {MAX_IMAGE_PIXELS} pixels are allowed')
+    return image
+
+def error_response(e):
+    """JSON error response using the exception's status_code if it has one (500 otherwise)"""
+    response = jsonify({'error': str(e)})
+    response.status_code = getattr(e, 'status_code', 500)
+    if isinstance(e, ServerBusy):
+        response.headers['Retry-After'] = '5'
+    return response
+
+class JobQueueFull(Exception):
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+class JobQueue:
+    """Bounded queue of background jobs run by a fixed set of worker threads.
+    Jobs are plain dicts tracked by id; finished jobs are kept for JOB_RESULT_TTL seconds
+    so clients can poll for the result, the same way /check-status polls ComfyUI prompts.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_depth=JOB_QUEUE_MAX_DEPTH, result_ttl=JOB_RESULT_TTL):
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.max_depth = max_depth
+        self._queue = queue.Queue()
+        self._queued = 0  # jobs waiting to run; cancelled ones stop counting right away
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _start(self):
+        # Worker threads start with the first job rather than at import, so they belong to
+        # the process that serves requests when gunicorn forks workers from a preloaded app
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True).start()
+
+    def submit(self, fn):
+        """Queue fn(job) and return the new job id. fn returns the job's result bytes
+        and may call job['set_stage'](name, progress) to report progress."""
+        self._start()
+        self._prune()
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'stage': None,
+            'progress': 0.0,
+            'error': None,
+            'result': None,
+            'etag': None,
+            'mimetype': None,
+            'created': time.time(),
+            'finished': None,
+            'cancelled': threading.Event(),
+        }
+
+        def set_stage(stage, progress):
+            if job['cancelled'].is_set():
+                raise JobCancelled()
+            job['stage'], job['progress'] = stage, progress
+
+        job['set_stage'] = set_stage
+        with self._lock:
+            if self._queued >= self.max_depth:
+                raise JobQueueFull(f"Job queue is full ({self.max_depth} queued)")
+            self._queued += 1
+            self._jobs[job_id] = job
+        self._queue.put((job, fn))
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job. Queued jobs never start; running jobs stop at their next stage."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job['status'] in ('queued', 'running'):
+                job['cancelled'].set()
+                if job['status'] == 'queued':
+                    # Its queue entry is skipped by the worker that pops it
+                    self._queued -= 1
+                    self._finish(job, 'cancelled')
+        return job
+
+    def depth(self):
+        with self._lock:
+            return self._queued
+
+    def _finish(self, job, status, result=None, error=None):
+        job.update(status=status, result=result, error=error, finished=time.time())
+        if status == 'completed':
+            job['progress'] = 1.0
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished'] and job['finished'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job, fn = self._queue.get()
+            with self._lock:
+                if job['status'] != 'queued':
+                    continue
+                self._queued -= 1
+                job['status'] = 'running'
+            try:
+                result = fn(job)
+            except JobCancelled:
+                self._finish(job, 'cancelled')
+            except Exception as e:
+                logger.exception("Error in job %s", job['id'])
+                self._finish(job, 'failed', error=str(e))
+            else:
+                self._finish(job, 'cancelled' if job['cancelled'].is_set() else 'completed', result=result)
+
+job_queue = JobQueue()
+
+def job_status(job):
+    """JSON-safe view of a job"""
+    status = {key: job[key] for key in ('id', 'status', 'stage', 'progress', 'error', 'created', 'finished')}
+    status['queue_depth'] = job_queue.depth()
+    if job['status'] == 'completed':
+        status['result_url'] = f"/jobs/{job['id']}/result"
+    return status
+
+class ComfyUIClient:
+    """Shared HTTP client for the ComfyUI API.
+    Reuses keep-alive connections from one pool, applies a default timeout to every call,
+    retries transient failures a bounded number of times with jittered backoff, and records
+    per-endpoint latency.
+    """
+
+    RETRY_STATUSES = {502, 503, 504}
+    # Calls that are also reported as processing stages
+    STAGES = {
+        'POST /prompt': 'comfyui_queue',
+        'GET /history': 'comfyui_poll',
+        'GET /history/{prompt_id}': 'comfyui_poll',
+    }
+
+    def __init__(self, api_url=COMFYUI_API, timeout=COMFYUI_TIMEOUT, max_retries=COMFYUI_MAX_RETRIES,
+                 pool_size=COMFYUI_POOL_SIZE):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """Send a request to ComfyUI; raises requests exceptions once retries are exhausted"""
+        url = f"{self.api_url}{path}"
+        endpoint = self._endpoint_name(method, path)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except requests.RequestException as e:
+                self._record(endpoint, time.perf_counter() - start, error=True)
+                if attempt >= self.max_retries or not self._can_retry(method, e):
+                    raise
+            else:
+                failed = response.status_code in self.RETRY_STATUSES
+                self._record(endpoint, time.perf_counter() - start, error=failed or not response.ok)
+                if not failed or method != 'GET' or attempt >= self.max_retries:
+                    return response
+                response.close()
+            attempt += 1
+            # Exponential backoff with full jitter
+            time.sleep(random.uniform(0, 0.25 * 2 ** attempt))
+
+    @staticmethod
+    def _can_retry(method, error):
+        if method == 'GET':
+            return isinstance(error, (requests.ConnectionError, requests.Timeout))
+        # Anything else may already have reached ComfyUI (e.g. queued a prompt), so only
+        # retry when the connection was never established
+        return isinstance(error, requests.ConnectTimeout) or (
+            isinstance(error, requests.ConnectionError) and ComfyUIClient._never_connected(error))
+
+    @staticmethod
+    def _never_connected(error):
+        """Whether urllib3 failed to open the connection (NewConnectionError) anywhere in the
+        chain behind a requests error: its MaxRetryError argument's reason, causes and contexts"""
+        pending, seen = [error], set()
+        while pending:
+            e = pending.pop()
+            if e is None or id(e) in seen:
+                continue
+            seen.add(id(e))
+            if isinstance(e, NewConnectionError):
+                return True
+            pending.extend([getattr(e, 'reason', None), e.__cause__, e.__context__])
+            pending.extend(arg for arg in e.args if isinstance(arg, BaseException))
+        return False
+
+    @staticmethod
+    def _endpoint_name(method, path):
+        # Group per-prompt and per-file URLs under one name, e.g. "GET /history/{prompt_id}"
+        path = path.split('?', 1)[0]
+        path = re.sub(r'^/history/[^/]+', '/history/{prompt_id}', path)
+        return f"{method} {path}"
+
+    def _record(self, endpoint, seconds, error):
+        metrics_registry.observe('comfyui_request_seconds', {'endpoint': endpoint}, seconds)
+        if endpoint in self.STAGES:
+            record_stage(self.STAGES[endpoint], seconds)
+        with self._lock:
+            metrics = self._metrics.setdefault(endpoint, {
+                'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+            })
+            metrics['count'] += 1
+            metrics['errors'] += int(error)
+            metrics['total_seconds'] += seconds
+            metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                endpoint: {**metrics, 'mean_seconds': metrics['total_seconds'] / metrics['count']}
+                for endpoint, metrics in self._metrics.items()
+            }
+
+comfy_client = ComfyUIClient()
+
+class ComfyUITracker:
+    """Tracks ComfyUI prompt progress and completion from its /ws event stream.
+    A single background listener keeps per-prompt state in memory so request handlers
+    can wait on an event instead of polling. Whenever the socket is down or an event may
+    have been missed, /history/<prompt_id> is used as the fallback source of truth.
+    """
+
+    def __init__(self, api_url=COMFYUI_API, client_id=None):
+        self.api_url = api_url
+        self._fixed_client_id = client_id  # None = generate one per process
+        self._client_id = None
+        self._client_pid = None
+        self.connected = threading.Event()
+        self._prompts = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    @property
+    def client_id(self):
+        """Id to queue prompts with: ComfyUI sends execution events only to the websocket of the
+        client that queued the prompt, so it must be unique per process. It's generated on first
+        use in each process, since with preload_app the tracker is created before gunicorn forks."""
+        if self._fixed_client_id is not None:
+            return self._fixed_client_id
+        pid = os.getpid()
+        if self._client_pid != pid:
+            self._client_id = f"background-remover-{pid}-{uuid.uuid4().hex[:8]}"
+            self._client_pid = pid
+        return self._client_id
+
+    def start(self):
+        """Start the websocket listener if it isn't running (no-op without websocket-client)"""
+        if websocket is None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='comfyui-tracker', daemon=True)
+                self._listener.start()
+
+    def track(self, prompt_id):
+        """Start tracking a prompt that was queued with this tracker's client_id"""
+        self.start()
+        with self._lock:
+            self._prune()
+            return self._prompts.setdefault(prompt_id, self._new_state())
+
+    @staticmethod
+    def _new_state():
+        return {
+            'status': 'pending',  # pending, running, completed or error
+            'node': None,
+            'progress': None,
+            'outputs': {},
+            'error': None,
+            'finished': None,
+            'checked': time.time(),  # last /history check
+            'done': threading.Event(),
+            'synced': False,  # outputs confirmed against /history
+            'subscribers': [],
+        }
+
+    def get(self, prompt_id):
+        with self._lock:
+            return self._prompts.get(prompt_id)
+
+    def status(self, prompt_id):
+        """Current state of a prompt, consulting /history when the websocket can't be trusted
+        (not connected, or a prompt this process never saw queued), at most once per
+        COMFYUI_HISTORY_POLL_INTERVAL while a prompt is still running in case its completion event
+        was missed, and once on completion, since cached nodes don't emit 'executed' events with
+        their outputs"""
+        state = self.get(prompt_id)
+        if state is None or (not state['done'].is_set() and not self.connected.is_set()):
+            state = self.refresh_from_history(prompt_id) or state
+        elif not state['done'].is_set():
+            if time.time() - state['checked'] >= COMFYUI_HISTORY_POLL_INTERVAL:
+                self.refresh_from_history(prompt_id)
+        elif state['done'].is_set() and not state['synced']:
+            self.refresh_from_history(prompt_id)
+        return state
+
+    def wait(self, prompt_id, timeout):
+        """Block until the prompt finishes or timeout seconds pass; returns its state"""
+        state = self.track(prompt_id)
+        deadline = time.time() + timeout
+        with timed('comfyui_wait'):
+            while not state['done'].is_set():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError("Timeout waiting for ComfyUI to process the workflow")
+                if state['done'].wait(min(COMFYUI_HISTORY_POLL_INTERVAL, remaining)):
+                    break
+                # No completion event yet; make sure one wasn't missed
+                self.refresh_from_history(prompt_id)
+        return state
+
+    def refresh_from_history(self, prompt_id):
+        """Update the prompt's state from GET /history/<prompt_id>; returns the state or None"""
+        state = self.get(prompt_id)
+        if state is not None:
+            state['checked'] = time.time()
+        try:
+            response = comfy_client.get(f"/history/{prompt_id}")
+            if not response.ok:
+                return None
+            entry = response.json().get(prompt_id)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Error getting history for %s: %s", prompt_id, e)
+            return None
+        if entry is None:
+            return self.get(prompt_id)
+
+        with self._lock:
+            state = self._prompts.setdefault(prompt_id, self._new_state())
+        status = entry.get('status', {})
+        state['outputs'] = entry.get('outputs', {})
+        state['synced'] = True
+        if status.get('status_str') == 'error':
+            self._finish(state, 'error', error=self._history_error(status))
+        elif status.get('completed', False) or state['outputs']:
+            self._finish(state, 'completed')
+        return state
+
+    @staticmethod
+    def _history_error(status):
+        for message_type, data in status.get('messages', []):
+            if message_type == 'execution_error':
+                return data.get('exception_message', 'Execution error')
+        return 'Execution error'
+
+    def _finish(self, state, status, error=None):
+        state['status'] = status
+        state['error'] = error
+        state['finished'] = state['finished'] or time.time()
+        state['done'].set()
+        self._notify(state, {'type': 'finished', 'data': {'status': status, 'error': error}})
+
+    def subscribe(self, prompt_id):
+        """Return a queue that receives every event for the prompt (as {'type', 'data'} dicts)
+        from now on; call unsubscribe when done. Check the state for anything that came earlier."""
+        events = queue.Queue()
+        self.track(prompt_id)['subscribers'].append(events)
+        return events
+
+    def unsubscribe(self, prompt_id, events):
+        state = self.get(prompt_id)
+        if state is not None and events in state['subscribers']:
+            state['subscribers'].remove(events)
+
+    @staticmethod
+    def _notify(state, event):
+        for events in list(state['subscribers']):
+            events.put(event)
+
+    def _prune(self):
+        # Caller must hold self._lock
+        cutoff = time.time() - COMFYUI_PROMPT_TTL
+        for prompt_id in [p for p, state in self._prompts.items() if state['finished'] and state['finished'] < cutoff]:
+            del self._prompts[prompt_id]
+
+    def _listen(self):
+        ws_url = self.api_url.replace('http', 'ws', 1) + f"/ws?clientId={self.client_id}"
+        backoff = 1
+        while True:
+            try:
+                ws = websocket.create_connection(ws_url, timeout=30)
+            except Exception as e:
+                # Warn once per outage; the retries that follow are only logged at debug level
+                log = logger.warning if backoff == 1 else logger.debug
+                log("ComfyUI websocket unavailable (%s), retrying in %ss", e, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            logger.info("Connected to ComfyUI websocket")
+            self.connected.set()
+            backoff = 1
+            # Anything that finished while we were disconnected only shows up in history
+            for prompt_id, state in list(self._prompts.items()):
+                if not state['done'].is_set():
+                    self.refresh_from_history(prompt_id)
+            try:
+                while True:
+                    try:
+                        message = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if isinstance(message, str):  # binary messages are preview images
+                        self._handle(json.loads(message))
+            except Exception as e:
+                logger.warning("ComfyUI websocket disconnected: %s", e)
+            finally:
+                self.connected.clear()
+                ws.close()
+
+    def _handle(self, message):
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if prompt_id is None:
+            return
+        # Events only arrive for prompts queued with our client_id, so keep state even for prompts
+        # not tracked yet; events can beat the /prompt response that tells us the id
+        with self._lock:
+            state = self._prompts.setdefault(prompt_id, self._new_state())
+        if state['done'].is_set():
+            return
+
+        message_type = message.get('type')
+        if message_type == 'execution_start':
+            state['status'] = 'running'
+        elif message_type == 'executing':
+            state['status'] = 'running'
+            state['node'] = data.get('node')
+            if data.get('node') is None:
+                # node is None once the whole prompt has executed
+                self._finish(state, 'completed')
+        elif message_type == 'progress':
+            state['progress'] = {'node': data.get('node'), 'value': data.get('value'), 'max': data.get('max')}
+        elif message_type == 'executed':
+            state['outputs'][data.get('node')] = data.get('output') or {}
+        elif message_type == 'execution_success':
+            self._finish(state, 'completed')
+        elif message_type == 'execution_error':
+            self._finish(state, 'error', error=data.get('exception_message', 'Execution error'))
+        elif message_type == 'execution_interrupted':
+            self._finish(state, 'error', error='Execution interrupted')
+        else:
+            return
+
+        if not state['done'].is_set():
+            self._notify(state, {'type': message_type, 'data': data})
+
+comfy_tracker = ComfyUITracker()
+
+def collect_output_images(outputs, skip_temp=False):
+    """Flatten ComfyUI node outputs into a list of image descriptors"""
+    images = []
+    for node_id, node_output in outputs.items():
+        for image in node_output.get('images', []):
+            # Skip temporary preview images if requested
+            if skip_temp and image['filename'].startswith(('PB-_temp_', 'ComfyUI_temp_')):
+                continue
+            images.append(image)
+    return images
+
+def parse_comfyui_image_ref(value):
+    """Normalize an output image reference (a ComfyUI /view URL or a {filename, subfolder, type}
+    dict) to /view query parameters. Only the parameters are kept, so requests always go to COMFYUI_API."""
+    if isinstance(value, str):
+        query = parse_qs(urlparse(value).query)
+        value = {key: values[0] for key, values in query.items()}
+    if not isinstance(value, dict) or not value.get('filename'):
+        raise ValueError(f"Invalid ComfyUI image reference: {value}")
+    return {
+        'filename': value['filename'],
+        'subfolder': value.get('subfolder', ''),
+        'type': value.get('type', 'output'),
+    }
+
+def stream_comfyui_image(ref, dest):
+    """Copy an output image from ComfyUI's /view into the writable file object dest, chunk by chunk"""
+    with timed('comfyui_download'), comfy_client.get('/view', params=ref, stream=True) as response:
+        if not response.ok:
+            raise Exception(f"Failed to fetch {ref['filename']} from ComfyUI: {response.status_code}")
+        for chunk in response.iter_content(COMFYUI_VIEW_CHUNK_SIZE):
+            dest.write(chunk)
+
+def process_comfyui_image(ref, settings):
+    """Stream a ComfyUI output image into process_image and return the PNG bytes"""
+    # Spools to disk only if the image is unusually large, and is decoded from there
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES) as buffer:
+        stream_comfyui_image(ref, buffer)
+        image_hash = hash_stream(buffer)
+        return encode_bytes(process_image(open_image(buffer), settings, image_hash=image_hash))
+
+class WorkflowRegistry:
+    """Parsed ComfyUI workflows, read once per file and reloaded when the file's mtime changes.
+    The returned workflows are shared between requests and must be treated as read-only;
+    use patch_workflow to derive request-specific copies.
+    """
+
+    def __init__(self):
+        self._workflows = {}  # path -> (mtime_ns, workflow)
+        self._lock = threading.Lock()
+
+    def get(self, workflow_file):
+        mtime = os.stat(workflow_file).st_mtime_ns
+        with self._lock:
+            cached = self._workflows.get(workflow_file)
+            if cached and cached[0] == mtime:
+                return cached[1]
+            with open(workflow_file, 'r') as f:
+                workflow = json.load(f)
+            self._workflows[workflow_file] = (mtime, workflow)
+            logger.info("Loaded workflow from %s (%d nodes)", workflow_file, len(workflow))
             return workflow
+
+workflow_registry = WorkflowRegistry()
+
+def load_workflow(workflow_file):
+    try:
+        return workflow_registry.get(workflow_file)
     except Exception as e:
-        print(f"Error loading workflow: {str(e)}")
+        logger.error("Error loading workflow: %s", e)
         raise
 
-def get_base_images():
-    """Get list of base images from the base-img directory"""
-    base_dir = Path(BASE_IMAGES_DIR)
-    if not base_dir.exists():
-        base_dir.mkdir(exist_ok=True)
-    return [f.name for f in base_dir.glob("base-*.png")]
+def add_patch(patches, workflow, node_id, **inputs):
+    """Record input overrides for node_id, if the workflow has that node"""
+    if node_id in workflow:
+        patches.setdefault(node_id, {}).update(inputs)
+
+def patch_workflow(workflow, patches):
+    """Return a copy of workflow with patches ({node_id: {input: value}}) applied.
+    Only the patched nodes and their inputs are copied; every other node is shared
+    with the original.
+    """
+    patched = dict(workflow)
+    for node_id, inputs in patches.items():
+        node = dict(workflow[node_id])
+        node['inputs'] = {**node.get('inputs', {}), **inputs}
+        patched[node_id] = node
+        logger.debug("Updated node %s: %s", node_id, node)
+    return patched
+
+class BaseImageCatalog:
+    """In-memory index of the base-*.png images in BASE_IMAGES_DIR with their dimensions and
+    content hashes. The directory is only rescanned when its mtime changes (or every
+    rescan_interval seconds), and unchanged files keep their entries. Thumbnails are named by
+    content hash and size, generated in the background for new images and cached on disk.
+    """
+
+    def __init__(self, directory=BASE_IMAGES_DIR, thumbnail_dir=BASE_IMAGE_THUMBNAIL_DIR,
+                 sizes=BASE_IMAGE_THUMBNAIL_SIZES, rescan_interval=BASE_IMAGE_RESCAN_INTERVAL):
+        # Absolute, because send_file resolves relative paths against the app's root instead
+        self.directory = Path(directory).absolute()
+        self.thumbnail_dir = Path(thumbnail_dir).absolute()
+        self.sizes = tuple(sorted(sizes))
+        self.rescan_interval = rescan_interval
+        self.version = None  # hash of the whole listing, used as its ETag
+        self._entries = {}
+        self._by_hash = {}
+        self._dir_mtime = None
+        self._scanned_at = 0
+        self._lock = threading.Lock()
+
+    def _stale(self):
+        try:
+            mtime = self.directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            mtime = self.directory.stat().st_mtime_ns
+        return mtime != self._dir_mtime or time.monotonic() - self._scanned_at > self.rescan_interval, mtime
+
+    def entries(self):
+        """Catalog entries sorted by name, rescanning the directory first if it changed"""
+        stale, mtime = self._stale()
+        if stale:
+            with self._lock:
+                self._scan(mtime)
+        return [self._entries[name] for name in sorted(self._entries)]
+
+    def _scan(self, mtime):
+        # Caller must hold self._lock
+        entries, new = {}, []
+        for path in self.directory.glob('base-*.png'):
+            try:
+                stat = path.stat()
+                entry = self._entries.get(path.name)
+                if entry is None or (entry['bytes'], entry['mtime']) != (stat.st_size, stat.st_mtime_ns):
+                    with open(path, 'rb') as f:
+                        digest = hash_stream(f)[:16]
+                        width, height = Image.open(f).size
+                    entry = {'name': path.name, 'hash': digest, 'width': width, 'height': height,
+                             'bytes': stat.st_size, 'mtime': stat.st_mtime_ns}
+                    new.append(entry)
+                entries[path.name] = entry
+            except (OSError, Image.UnidentifiedImageError) as e:
+                logger.warning("Skipping base image %s: %s", path.name, e)
+
+        self._entries = entries
+        self._by_hash = {entry['hash']: entry for entry in entries.values()}
+        self._dir_mtime, self._scanned_at = mtime, time.monotonic()
+        self.version = hashlib.sha256(
+            json.dumps(sorted((e['name'], e['hash']) for e in entries.values())).encode()
+        ).hexdigest()[:16]
+        if new:
+            threading.Thread(target=self._generate_thumbnails, args=(new,),
+                             name='base-thumbnails', daemon=True).start()
+
+    def thumbnail_sizes(self, entry):
+        """{size: (width, height)} of the thumbnails made for entry; sizes at or above the
+        image's own are skipped, since the original serves those"""
+        longest = max(entry['width'], entry['height'])
+        return {
+            size: (max(1, round(entry['width'] * size / longest)), max(1, round(entry['height'] * size / longest)))
+            for size in self.sizes if size < longest
+        }
+
+    def _generate_thumbnails(self, entries):
+        for entry in entries:
+            for size in self.thumbnail_sizes(entry):
+                try:
+                    self.thumbnail(entry['hash'], size)
+                except Exception as e:
+                    logger.warning("Error generating thumbnail for %s: %s", entry['name'], e)
+
+    def thumbnail(self, image_hash, size):
+        """Path of the thumbnail of the given size for the image with image_hash, generating
+        it if it isn't on disk yet; None if there's no such image or size"""
+        entry = self._by_hash.get(image_hash)
+        if entry is None or size not in self.thumbnail_sizes(entry):
+            return None
+        path = self.thumbnail_dir / f"{image_hash}-{size}.png"
+        if path.exists():
+            return path
+
+        self.thumbnail_dir.mkdir(parents=True, exist_ok=True)
+        with Image.open(self.directory / entry['name']) as image:
+            image.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            image.save(tmp_path, format='PNG', optimize=True)
+        os.replace(tmp_path, path)
+        return path
+
+    def listing(self):
+        """The /base-images response body"""
+        images = []
+        for entry in self.entries():
+            thumbnails = [
+                {'size': size, 'width': width, 'height': height,
+                 'url': f"/base-thumbnails/{entry['hash']}-{size}.png"}
+                for size, (width, height) in self.thumbnail_sizes(entry).items()
+            ]
+            images.append({
+                'name': entry['name'],
+                'url': f"/base-img/{entry['name']}?v={entry['hash']}",
+                'width': entry['width'],
+                'height': entry['height'],
+                'hash': entry['hash'],
+                'bytes': entry['bytes'],
+                'thumbnails': thumbnails,
+            })
+        return {'images': images}
+
+    def get(self, name):
+        """Catalog entry for a base image file name, or None"""
+        self.entries()
+        return self._entries.get(name)
+
+base_image_catalog = BaseImageCatalog()
 
 def modify_workflow(workflow, style_image_path=None, base_image=None, prompt=None, negative_prompt=None, steps=20, batch_size=1, weight_style=0.5):
     """Modify the workflow with the given parameters"""
-    print("Starting workflow modification...")
-    workflow_copy = json.loads(json.dumps(workflow))
+    patches = {}
     
     # Add random seed generation
-    if '3' in workflow_copy:
-        random_seed = np.random.randint(np.iinfo(np.int32).max)
-        print(f"Setting random seed: {random_seed}")
-        workflow_copy['3']['inputs']['seed'] = int(random_seed)
+    add_patch(patches, workflow, '3', seed=int(np.random.randint(np.iinfo(np.int32).max)))
     
     # Update empty latent image batch size (node 5)
-    if '5' in workflow_copy:
-        print(f"Setting batch size: {batch_size}")
-        workflow_copy['5']['inputs']['batch_size'] = int(batch_size)
-        print(f"Updated empty latent node: {workflow_copy['5']}")
+    add_patch(patches, workflow, '5', batch_size=int(batch_size))
     
     # Update style image path (node 12)
-    if style_image_path and '12' in workflow_copy:
-        print(f"Setting style image path: {style_image_path}")
-        workflow_copy['12']['inputs']['image'] = style_image_path
-        workflow_copy['12']['inputs']['upload'] = 'file'
-        print(f"Updated style image node: {workflow_copy['12']}")
+    if style_image_path:
+        add_patch(patches, workflow, '12', image=style_image_path, upload='file')
     
     # Update base image path (node 47)
-    if base_image and '47' in workflow_copy:
-        print(f"Setting base image: {base_image}")
-        workflow_copy['47']['inputs']['image'] = base_image
-        print(f"Updated base image node: {workflow_copy['47']}")
+    if base_image:
+        add_patch(patches, workflow, '47', image=base_image)
     
     # Update positive prompt (node 6)
-    if prompt and '6' in workflow_copy:
-        print(f"Setting prompt: {prompt}")
-        workflow_copy['6']['inputs']['text'] = prompt
-        print(f"Updated positive prompt node: {workflow_copy['6']}")
+    if prompt:
+        add_patch(patches, workflow, '6', text=prompt)
     
     # Update negative prompt (node 7)
-    if negative_prompt and '7' in workflow_copy:
-        print(f"Setting negative prompt: {negative_prompt}")
-        workflow_copy['7']['inputs']['text'] = negative_prompt
-        print(f"Updated negative prompt node: {workflow_copy['7']}")
+    if negative_prompt:
+        add_patch(patches, workflow, '7', text=negative_prompt)
     
     # Update steps (node 3)
-    if steps and '3' in workflow_copy:
-        print(f"Setting steps: {steps}")
-        workflow_copy['3']['inputs']['steps'] = int(steps)
-        print(f"Updated KSampler node: {workflow_copy['3']}")
+    if steps:
+        add_patch(patches, workflow, '3', steps=int(steps))
     
     # Update weight_style (node 32)
-    if '32' in workflow_copy:
-        print(f"Setting weight_style: {weight_style}")
-        workflow_copy['32']['inputs']['weight_style'] = float(weight_style)
-        print(f"Updated IPAdapter node: {workflow_copy['32']}")
+    add_patch(patches, workflow, '32', weight_style=float(weight_style))
     
-    print("Workflow modification complete")
-    return workflow_copy
+    logger.debug("Workflow patches: %s", patches)
+    return patch_workflow(workflow, patches)
 
 def modify_generate_workflow(workflow, prompt=None, negative_prompt=None, steps=10, batch_size=1, cfg=4, checkpoint=None, width=800, height=800):
     """Modify the generation workflow with the given parameters"""
-    print("Starting generation workflow modification...")
-    workflow_copy = json.loads(json.dumps(workflow))
+    patches = {}
     
-    # Add random seed generation
-    if '3' in workflow_copy:
-        random_seed = np.random.randint(np.iinfo(np.int32).max)
-        print(f"Setting random seed: {random_seed}")
-        workflow_copy['3']['inputs']['seed'] = int(random_seed)
-        
-        # Update cfg
-        print(f"Setting cfg: {cfg}")
-        workflow_copy['3']['inputs']['cfg'] = float(cfg)
+    # Add random seed generation and update cfg (node 3)
+    add_patch(patches, workflow, '3', seed=int(np.random.randint(np.iinfo(np.int32).max)), cfg=float(cfg))
     
     # Update empty latent image batch size and dimensions (node 5)
-    if '5' in workflow_copy:
-        print(f"Setting batch size: {batch_size}")
-        workflow_copy['5']['inputs']['batch_size'] = int(batch_size)
-        print(f"Setting dimensions: {width}x{height}")
-        workflow_copy['5']['inputs']['width'] = int(width)
-        workflow_copy['5']['inputs']['height'] = int(height)
+    add_patch(patches, workflow, '5', batch_size=int(batch_size), width=int(width), height=int(height))
     
     # Update checkpoint (node 4)
-    if checkpoint and '4' in workflow_copy:
-        print(f"Setting checkpoint: {checkpoint}")
-        workflow_copy['4']['inputs']['ckpt_name'] = checkpoint
+    if checkpoint:
+        add_patch(patches, workflow, '4', ckpt_name=checkpoint)
     
     # Update positive prompt (node 6)
-    if prompt and '6' in workflow_copy:
-        print(f"Setting prompt: {prompt}")
-        workflow_copy['6']['inputs']['text'] = prompt
+    if prompt:
+        add_patch(patches, workflow, '6', text=prompt)
     
     # Update negative prompt (node 7)
-    if negative_prompt and '7' in workflow_copy:
-        print(f"Setting negative prompt: {negative_prompt}")
-        workflow_copy['7']['inputs']['text'] = negative_prompt
+    if negative_prompt:
+        add_patch(patches, workflow, '7', text=negative_prompt)
     
     # Update steps (node 3)
-    if steps and '3' in workflow_copy:
-        print(f"Setting steps: {steps}")
-        workflow_copy['3']['inputs']['steps'] = int(steps)
+    if steps:
+        add_patch(patches, workflow, '3', steps=int(steps))
     
-    print("Generation workflow modification complete")
-    return workflow_copy
+    logger.debug("Generation workflow patches: %s", patches)
+    return patch_workflow(workflow, patches)
 
 @app.route('/')
 def index():
@@ -288,9 +2198,10 @@ def index():
 def switch_model():
     try:
         model_name = request.json.get('model')
-        global session
-        session = new_session(model_name)
+        session_pool.set_default(model_name)
         return {'status': 'success'}
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 400
     except Exception as e:
         return {'status': 'error', 'message': str(e)}, 500
 
@@ -298,60 +2209,229 @@ def switch_model():
 def get_models():
     return jsonify(AVAILABLE_MODELS)
 
-def process_image(image, settings):
-    """Process image with background removal and optional fitting/resizing"""
-    # Convert to RGBA if not already
-    if image.mode != 'RGBA':
-        image = image.convert('RGBA')
-    
-    # Create a new session with the selected model
-    session = new_session(settings['model'])
+def segmentation_proxy_side(size, settings):
+    """Longest side to segment at, or None for full resolution: the request's
+    segmentation_max_side, or SEGMENTATION_PROXY_MAX_SIDE when background removal at full
+    size is estimated to exceed REQUEST_MEMORY_BUDGET"""
+    width, height = size
+    max_side = settings.get('segmentation_max_side')
+    if not max_side and width * height * MATTING_BYTES_PER_PIXEL > REQUEST_MEMORY_BUDGET:
+        max_side = SEGMENTATION_PROXY_MAX_SIDE
+    if max_side and max(width, height) > int(max_side):
+        return int(max_side)
+    return None
+
+def remove_with_proxy(image, max_side, **kwargs):
+    """Run remove() on a copy of image downscaled to fit max_side, then apply its alpha,
+    upscaled, to the full-size image. Peak memory depends on max_side rather than on the
+    input size, at the cost of edge detail from the full-resolution matting."""
+    # remove() corrects EXIF orientation itself; the full-size image must match the proxy
+    if image.getexif().get(0x0112, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+    scale = max_side / max(image.size)
+    proxy_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    proxy = image.resize(proxy_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    logger.debug("Segmenting %dx%d image on a %dx%d proxy", image.width, image.height, *proxy_size)
+    alpha = remove(proxy, **kwargs).getchannel('A')
+    del proxy
+
+    output = image.convert('RGBA')
+    output.putalpha(alpha.resize(image.size, Image.Resampling.BICUBIC))
+    return output
+
+_matting_executor = None
+_matting_executor_lock = threading.Lock()
+
+def get_matting_executor():
+    """Return the shared executor that solves high-res matting tiles, creating it on first use.
+    pymatting's Laplacian and solver kernels release the GIL, so threads use all cores."""
+    global _matting_executor
+    with _matting_executor_lock:
+        if _matting_executor is None:
+            _matting_executor = ThreadPoolExecutor(max_workers=HIGH_RES_WORKERS,
+                                                   thread_name_prefix='matting')
+        return _matting_executor
+
+def matting_trimap(mask, foreground_threshold, background_threshold, erode_size):
+    """Trimap (255 foreground, 0 background, 128 unknown) for a uint8 mask array, built like
+    rembg's alpha matting trimap but eroded with OpenCV"""
+    is_foreground = (mask > foreground_threshold).astype(np.uint8)
+    is_background = (mask < background_threshold).astype(np.uint8)
+    if erode_size > 0:
+        kernel = np.ones((erode_size, erode_size), dtype=np.uint8)
+        # Same borders as rembg: foreground erodes at the image edge, background doesn't
+        is_foreground = cv2.erode(is_foreground, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+        is_background = cv2.erode(is_background, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=1)
+
+    trimap = np.full(mask.shape, 128, dtype=np.uint8)
+    trimap[is_foreground.view(bool)] = 255
+    trimap[is_background.view(bool)] = 0
+    return trimap
+
+def matte_tile(rgb, trimap, mask, box, margin=HIGH_RES_TILE_MARGIN):
+    """Closed-form alpha and foreground colors (floats in [0, 1]) for the box region, solved
+    with at least margin pixels of surrounding context. The context grows until it holds both
+    foreground and background pixels; returns None if it never does (like rembg, the caller
+    then keeps the plain mask)."""
+    left, top, right, bottom = box
+    height, width = trimap.shape
+    for context in (margin, 4 * margin, 16 * margin):
+        x0, y0 = max(left - context, 0), max(top - context, 0)
+        x1, y1 = min(right + context, width), min(bottom + context, height)
+        tile_trimap = trimap[y0:y1, x0:x1]
+        if (tile_trimap == 255).any() and (tile_trimap == 0).any():
+            break
+    else:
+        return None
+
+    from pymatting import estimate_alpha_cf, estimate_foreground_ml
+    from pymatting.preconditioner.jacobi import jacobi
+
+    tile_trimap = tile_trimap / 255.0
+    tile = rgb[y0:y1, x0:x1] / 255.0
+    # The solver starts from the mask, which is already close. Building pymatting's default
+    # incomplete Cholesky preconditioner costs several times the solve itself on a tile, so
+    # the Jacobi one is used; the result differs by at most a level or so in 8 bits.
+    unknown = (tile_trimap > 0.1) & (tile_trimap < 0.9)
+    initial = mask[y0:y1, x0:x1][unknown] / 255.0
+    alpha = estimate_alpha_cf(tile, tile_trimap, preconditioner=jacobi, cg_kwargs={'x0': initial})
+    foreground = estimate_foreground_ml(tile, alpha)
+    inner = (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+    return alpha[inner], foreground[inner]
+
+def remove_high_res(image, session, settings, proxy_side=HIGH_RES_PROXY_SIDE, tile_size=HIGH_RES_TILE_SIZE):
+    """Background removal for large images: the model runs on a proxy of at most proxy_side
+    (it works at 320 or 1024 internally anyway), and closed-form matting runs at full resolution
+    but only on the tiles that touch the unknown band of the trimap, in parallel. Elsewhere the
+    alpha is the trimap's 0 or 255 and the colors are the input's.
+    """
+    # remove() would correct EXIF orientation; do it here since the mask must match the pixels
+    if image.getexif().get(0x0112, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+    width, height = image.size
+
+    scale = proxy_side / max(width, height)
+    if scale < 1:
+        proxy = image.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                             Image.Resampling.LANCZOS, reducing_gap=3.0)
+    else:
+        proxy = image
+    mask = session.predict(proxy)[0]
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.Resampling.BILINEAR)
+    mask = np.asarray(mask)
+
+    # Background threshold is rembg's default, as process_image doesn't override it
+    trimap = matting_trimap(mask, settings['foreground_threshold'], 10, settings['erode_size'])
+    rgb = np.asarray(image)
+    unknown = trimap == 128
+
+    output = np.empty((height, width, 4), dtype=np.uint8)
+    output[..., :3] = rgb
+    # Unknown pixels keep the upscaled mask value unless their tile is solved below
+    output[..., 3] = np.where(unknown, mask, trimap)
+
+    boxes = [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+             for y in range(0, height, tile_size) for x in range(0, width, tile_size)
+             if unknown[y:y + tile_size, x:x + tile_size].any()]
+    logger.debug("High-res matting: %d tiles of %dpx with edge pixels", len(boxes), tile_size)
+    executor = get_matting_executor()
+    futures = {executor.submit(matte_tile, rgb, trimap, mask, box): box for box in boxes}
+    for future in as_completed(futures):
+        result = future.result()
+        if result is None:
+            continue
+        alpha, foreground = result
+        left, top, right, bottom = futures[future]
+        region = output[top:bottom, left:right]
+        # Same truncating conversion as rembg's alpha matting cutout
+        region[..., :3] = np.clip(foreground * 255, 0, 255).astype(np.uint8)
+        region[..., 3] = np.clip(alpha * 255, 0, 255).astype(np.uint8)
+
+    return Image.fromarray(output, 'RGBA')
+
+def process_image(image, settings, image_hash=None, progress=None):
+    """Process image with background removal and optional fitting/resizing.
+    image_hash (e.g. a hash of the uploaded bytes) keys the raw mask cache; without it
+    the decoded pixels are hashed instead. progress, if given, is called as
+    progress(stage, fraction) before each stage. The image's pixel count is reserved
+    from pixel_budget while it is processed.
+    """
+    with pixel_budget.reserve(image.width * image.height):
+        return _process_image(image, settings, image_hash, progress)
+
+def process_image_outputs(image, settings, outputs, image_hash=None, progress=None):
+    """Like process_image, but return one image per entry of outputs (see parse_outputs).
+    Background removal and fitting run once; the sizes are then produced by scale_cascade,
+    in place of the single target_width/target_height resize."""
+    base_settings = dict(settings, target_width=None, target_height=None)
+    with pixel_budget.reserve(image.width * image.height):
+        output = _process_image(image, base_settings, image_hash, progress)
+        sizes = [target_size(output.size, spec['width'], spec['height'], spec['maintain_aspect_ratio'])
+                 for spec in outputs]
+        if any(width * height > MAX_IMAGE_PIXELS for width, height in sizes):
+            raise ImageTooLarge(f"Output sizes are limited to {MAX_IMAGE_PIXELS} pixels")
+        logger.debug("Resizing %dx%d to %s", output.width, output.height, ', '.join(f'{w}x{h}' for w, h in sizes))
+        if progress:
+            progress('resizing', 0.9)
+        with timed('resize'):
+            return scale_cascade(output, sizes, settings.get('resample', 'lanczos'), RESIZE_REDUCING_GAP)
+
+def _process_image(image, settings, image_hash, progress):
+    progress = progress or (lambda stage, fraction: None)
+    progress('removing_background', 0.1)
+    # Alpha matting works on RGB, so convert straight to it rather than to RGBA and back
+    with timed('decode'):
+        image.load()
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
     
-    # Remove background using settings from frontend
-    output = remove(
-        image,
+    # Get the session for the selected model (default model if unset); with batched
+    # inference enabled, concurrent requests for the same model share one network run,
+    # and masks already computed for this image are reused
+    session = get_session(settings.get('model'), image_hash)
+    remove_options = dict(
         session=session,  # Use the model-specific session
         alpha_matting=True,
         alpha_matting_foreground_threshold=settings['foreground_threshold'],
         alpha_matting_erode_size=settings['erode_size']
     )
     
+    # Remove background using settings from frontend. High-res mode mattes only the mask
+    # edge; otherwise large images are segmented on a downscaled proxy so memory stays bounded
+    proxy_side = segmentation_proxy_side(image.size, settings)
+    start = time.perf_counter()
+    if settings.get('high_res', False):
+        output = remove_high_res(image, session, settings)
+    elif proxy_side:
+        output = remove_with_proxy(image, proxy_side, **remove_options)
+    else:
+        output = remove(image, **remove_options)
+    del image
+    # Everything remove() did besides running the model: mostly alpha matting
+    record_stage('alpha_matting', time.perf_counter() - start - session.predict_seconds, session.model_name)
+    metrics_registry.inc('images_processed_total', {'model': session.model_name})
+    
     # Apply padding if enabled
     if settings.get('border_enabled', False):  # Use get() with default for safety
         padding_size = settings.get('border_size', 0)
         print(f"Applying padding size: {padding_size}%")  # Debug log
-        output = fit_to_canvas(output, padding_percent=padding_size)
+        progress('fitting', 0.8)
+        with timed('fit_to_canvas'):
+            output = fit_to_canvas(output, padding_percent=padding_size,
+                                   resample=settings.get('resample', 'lanczos'))
     
     # Apply resizing if specified
     target_width = settings.get('target_width')
     target_height = settings.get('target_height')
     if target_width or target_height:
-        current_width, current_height = output.size
-        print(f"Current dimensions: {current_width}x{current_height}")  # Debug log
-        if settings.get('maintain_aspect_ratio', True):
-            # Calculate new dimensions maintaining aspect ratio
-            if target_width and target_height:
-                # Use the more constraining dimension
-                width_ratio = target_width / current_width
-                height_ratio = target_height / current_height
-                ratio = min(width_ratio, height_ratio)
-                new_width = int(current_width * ratio)
-                new_height = int(current_height * ratio)
-            elif target_width:
-                ratio = target_width / current_width
-                new_width = target_width
-                new_height = int(current_height * ratio)
-            else:  # target_height
-                ratio = target_height / current_height
-                new_width = int(current_width * ratio)
-                new_height = target_height
-        else:
-            # Use exact dimensions
-            new_width = target_width or current_width
-            new_height = target_height or current_height
-        
-        print(f"Resizing to: {new_width}x{new_height}")  # Debug log
-        output = output.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        print(f"Current dimensions: {output.width}x{output.height}")  # Debug log
+        progress('resizing', 0.9)
+        new_size = target_size(output.size, target_width, target_height,
+                               settings.get('maintain_aspect_ratio', True))
+        print(f"Resizing to: {new_size[0]}x{new_size[1]}")  # Debug log
+        with timed('resize'):
+            output = scale_image(output, new_size, settings.get('resample', 'lanczos'), RESIZE_REDUCING_GAP)
     
     return output
 
@@ -365,24 +2445,300 @@ def remove_background():
         
         # Get settings from frontend, which will include all defaults
         settings = json.loads(request.form.get('settings', '{}'))
+        # Large uploads are already spooled to disk by the form parser; hash and decode
+        # straight from that stream rather than reading it into memory
+        data_hash = hash_stream(file.stream)
         
-        # Load and process image
-        image = Image.open(file.stream)
-        output = process_image(image, settings)
-        
-        # Convert to bytes and return
-        img_byte_arr = io.BytesIO()
-        output.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
+        is_async = request.form.get('async', 'false').lower() == 'true'
+        if settings.get('outputs'):
+            if is_async:
+                return jsonify({'error': 'async is not supported with multiple outputs'}), 400
+            return remove_background_outputs(file, data_hash, settings)
+        if is_async:
+            return submit_remove_background_job(file.stream, data_hash, settings)
         
-        return send_file(
-            img_byte_arr,
-            mimetype='image/png'
+        # Load and process image, unless an identical request is already cached
+        return cached_image_response(
+            'remove-background', data_hash, normalize_settings(settings),
+            lambda: process_image(open_image(file.stream), settings, image_hash=data_hash)
         )
     
     except Exception as e:
         print(f"Error processing image: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
+
+def remove_background_outputs(file, data_hash, settings):
+    """Serve a multi-size request (settings 'outputs') as one zip (default) or multipart/mixed
+    response, chosen by the 'bundle' form field. Outputs without a format use the request's
+    negotiated encoding. Each output is cached separately; only when one is missing is the
+    image processed, once for all of them, and the outputs are then encoded in parallel.
+    """
+    bundle = request.form.get('bundle', 'zip')
+    if bundle not in ('zip', 'multipart'):
+        return jsonify({'error': f'Unsupported bundle: {bundle}'}), 400
+    outputs = parse_outputs(settings['outputs'], output_encoding())
+    params = dict(normalize_settings(settings),
+                  outputs=[{k: v for k, v in spec.items() if k != 'name'} for spec in outputs])
+    keys = [result_cache.make_key('remove-background', data_hash, dict(params, variant=i))
+            for i in range(len(outputs))]
+
+    bodies = [result_cache.get(key) for key in keys]
+    futures = {}
+    if all(body is not None for body in bodies):
+        # The sizes for the names and manifest come from the cached images' headers
+        sizes = [Image.open(BytesIO(body)).size for body in bodies]
+        for index, body in enumerate(bodies):
+            future = Future()
+            future.set_result(body)
+            futures[future] = index
+    else:
+        images = process_image_outputs(open_image(file.stream), settings, outputs, image_hash=data_hash)
+        sizes = [image.size for image in images]
+
+        def encode(index):
+            body = encode_bytes(images[index], outputs[index]['output'])
+            result_cache.put(keys[index], body)
+            return body
+
+        executor = get_resize_executor()
+        futures = {executor.submit(encode, index): index for index in range(len(outputs))}
+
+    stem = Path(secure_filename(file.filename or '') or 'image').stem
+    names = [spec['name'] or f"{stem}_{width}x{height}" for spec, (width, height) in zip(outputs, sizes)]
+    formats = [spec['output']['format'] for spec in outputs]
+    extra = [{'width': width, 'height': height, 'format': fmt} for (width, height), fmt in zip(sizes, formats)]
+    headers = {'X-Output-Count': str(len(outputs))}
+    if bundle == 'multipart':
+        boundary = uuid.uuid4().hex
+        body = stream_batch_multipart(names, futures, boundary, formats, extra)
+        return Response(body, mimetype=f'multipart/mixed; boundary={boundary}', headers=headers)
+    headers['Content-Disposition'] = f'attachment; filename="{stem}-sizes.zip"'
+    return Response(stream_batch_zip(names, futures, formats, extra), mimetype='application/zip', headers=headers)
+
+def submit_remove_background_job(stream, data_hash, settings):
+    """Queue a background removal job and return its id right away (202), or 429 if the queue is full"""
+    encoding = output_encoding()
+    key = result_cache.make_key('remove-background', data_hash,
+                                dict(normalize_settings(settings), output=encoding))
+    # The upload stream is closed when the request ends, so the job keeps its own copy
+    spool = spool_stream(stream)
+
+    def run(job):
+        def render():
+            job['set_stage']('decoding', 0.05)
+            output = process_image(open_image(spool), settings, image_hash=data_hash,
+                                   progress=job['set_stage'])
+            job['set_stage']('encoding', 0.95)
+            return encode_bytes(output, encoding)
+
+        job['etag'] = key
+        job['mimetype'] = OUTPUT_MIMETYPES[encoding['format']]
+        try:
+            body, _ = get_or_render(key, render)
+        finally:
+            spool.close()
+        return body
+
+    try:
+        job_id = job_queue.submit(run)
+    except JobQueueFull as e:
+        spool.close()
+        response = jsonify({'error': str(e)})
+        response.status_code = 429
+        response.headers['Retry-After'] = '5'
+        return response
+
+    return jsonify({
+        'job_id': job_id,
+        'status_url': f'/jobs/{job_id}',
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error']}), 500
+    if job['status'] != 'completed':
+        # Not ready yet (or cancelled); the status endpoint says which
+        return jsonify(job_status(job)), 409
+    return image_response(job['result'], job['etag'], 'JOB', job['mimetype'])
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+def get_batch_executor():
+    """Return the shared executor used for batch requests, creating it on first use"""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            if BATCH_EXECUTOR == 'process':
+                # Each worker process keeps its own session pool warm across batches
+                _batch_executor = ProcessPoolExecutor(max_workers=BATCH_MAX_WORKERS)
+            else:
+                _batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS,
+                                                     thread_name_prefix='batch')
+        return _batch_executor
+
+def process_batch_item(data, settings):
+    """Run process_image on encoded image bytes and return the PNG bytes"""
+    return encode_bytes(process_image(open_image(BytesIO(data)), settings,
+                                      image_hash=hashlib.sha256(data).hexdigest()))
+
+def collect_batch_items(files):
+    """Gather (name, bytes) pairs from 'images' uploads and any 'archive' zip files"""
+    items = []
+    for file in files.getlist('images'):
+        if file.filename:
+            items.append((secure_filename(file.filename) or 'image', file.read()))
+
+    for archive in files.getlist('archive'):
+        with zipfile.ZipFile(archive.stream) as zf:
+            for info in zf.infolist():
+                name = Path(info.filename)
+                if (info.is_dir() or name.name.startswith('.') or '__MACOSX' in name.parts
+                        or name.suffix.lower() not in BATCH_IMAGE_EXTENSIONS):
+                    continue
+                # Guard against zip bombs: no single entry may exceed the upload limit
+                if info.file_size > app.config['MAX_CONTENT_LENGTH']:
+                    raise ValueError(f"Archive entry too large: {info.filename}")
+                items.append((secure_filename(name.name) or 'image', zf.read(info)))
+    return items
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only, unseekable buffer that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_batch_results(futures):
+    """Yield (index, png_bytes, error) as each future finishes, cancelling leftovers on exit"""
+    try:
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield index, future.result(), None
+            except Exception as e:
+                logger.exception("Error processing batch item %d", index)
+                yield index, None, str(e)
+    finally:
+        # Stop queued work if the client went away mid-stream
+        for future in futures:
+            future.cancel()
+
+def batch_output_name(names, index, formats=None):
+    """Entry name for a batch result: the input's index and stem, with the output format's extension"""
+    return f"{index:04d}_{Path(names[index]).stem}.{formats[index] if formats else 'png'}"
+
+def stream_batch_zip(names, futures, formats=None, manifest_extra=None):
+    """Stream a zip with one entry per finished image, plus a manifest.json in input order.
+    formats, if given, is each item's output format (PNG otherwise); manifest_extra adds
+    per-item fields to the manifest."""
+    buffer = _ChunkBuffer()
+    manifest = [{'index': i, 'name': name, **(manifest_extra[i] if manifest_extra else {})}
+                for i, name in enumerate(names)]
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for index, data, error in iter_batch_results(futures):
+            if error is None:
+                filename = batch_output_name(names, index, formats)
+                manifest[index].update(status='success', output=filename)
+                zf.writestr(filename, data)
+            else:
+                manifest[index].update(status='error', error=error)
+            yield buffer.drain()
+        zf.writestr('manifest.json', json.dumps({'items': manifest}, indent=2))
+    yield buffer.drain()
+
+def stream_batch_multipart(names, futures, boundary, formats=None, manifest_extra=None):
+    """Stream a multipart/mixed body with one part per finished image, plus a trailing manifest part.
+    formats and manifest_extra are as for stream_batch_zip."""
+    manifest = [{'index': i, 'name': name, **(manifest_extra[i] if manifest_extra else {})}
+                for i, name in enumerate(names)]
+    for index, data, error in iter_batch_results(futures):
+        filename = batch_output_name(names, index, formats)
+        if error is None:
+            manifest[index].update(status='success', output=filename)
+            content_type = OUTPUT_MIMETYPES[formats[index] if formats else 'png']
+        else:
+            manifest[index].update(status='error', error=error)
+            content_type, filename = 'application/json', f"{Path(filename).stem}.error.json"
+            data = json.dumps({'index': index, 'name': names[index], 'error': error}).encode()
+        yield (f"--{boundary}\r\n"
+               f"Content-Type: {content_type}\r\n"
+               f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
+               f"X-Batch-Index: {index}\r\n"
+               f"X-Batch-Status: {manifest[index]['status']}\r\n\r\n").encode()
+        yield data + b"\r\n"
+    yield (f"--{boundary}\r\n"
+           f"Content-Type: application/json\r\n"
+           f"Content-Disposition: attachment; filename=\"manifest.json\"\r\n\r\n").encode()
+    yield json.dumps({'items': manifest}).encode() + f"\r\n--{boundary}--\r\n".encode()
+
+@app.route('/remove-background/batch', methods=['POST'])
+def remove_background_batch():
+    """Remove backgrounds from many images (or a zip) with one set of settings.
+    Results stream back as a zip (default) or multipart/mixed response as each image finishes;
+    a failed image is reported in the manifest instead of failing the batch.
+    """
+    try:
+        settings = json.loads(request.form.get('settings', '{}'))
+        response_format = request.form.get('format', 'zip')
+        if response_format not in ('zip', 'multipart'):
+            return jsonify({'error': f'Unsupported format: {response_format}'}), 400
+
+        items = collect_batch_items(request.files)
+        if not items:
+            return jsonify({'error': 'No images provided'}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Too many images (max {BATCH_MAX_ITEMS})'}), 400
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e)}), 400
+
+    logger.info("Processing batch of %d images", len(items))
+    executor = get_batch_executor()
+    names = [name for name, _ in items]
+    futures = {executor.submit(process_batch_item, data, settings): index
+               for index, (_, data) in enumerate(items)}
+
+    if response_format == 'multipart':
+        boundary = uuid.uuid4().hex
+        body = stream_batch_multipart(names, futures, boundary)
+        mimetype = f'multipart/mixed; boundary={boundary}'
+        headers = {}
+    else:
+        body = stream_batch_zip(names, futures)
+        mimetype = 'application/zip'
+        headers = {'Content-Disposition': 'attachment; filename="background-removed.zip"'}
+
+    headers['X-Batch-Count'] = str(len(items))
+    return Response(body, mimetype=mimetype, headers=headers)
 
 @app.route('/fit-to-canvas', methods=['POST'])
 def fit_image_to_canvas():
@@ -392,23 +2748,26 @@ def fit_image_to_canvas():
             
         file = request.files['image']
         padding_percent = int(request.form.get('padding', '0'))  # Default to 0 if not specified
+        resample = request.form.get('resample', 'lanczos')
+        if resample not in RESAMPLE_FILTERS:
+            return jsonify({'error': f'Unknown resample filter: {resample}'}), 400
         
-        # Open and fit image to canvas
-        img = Image.open(file)
-        fitted_img = fit_to_canvas(img, padding_percent=padding_percent)
+        def render():
+            image = open_image(file.stream)
+            with pixel_budget.reserve(image.width * image.height):
+                with timed('decode'):
+                    image.load()
+                with timed('fit_to_canvas'):
+                    return fit_to_canvas(image, padding_percent=padding_percent, resample=resample)
         
-        # Save to bytes
-        img_byte_arr = io.BytesIO()
-        fitted_img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        
-        return send_file(
-            img_byte_arr,
-            mimetype='image/png'
+        # Open and fit image to canvas, unless an identical request is already cached
+        return cached_image_response(
+            'fit-to-canvas', hash_stream(file.stream), {'padding': padding_percent, 'resample': resample},
+            render
         )
     except Exception as e:
         print(f"Error fitting image to canvas: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 @app.route('/resize-image', methods=['POST'])
 def resize_image():
@@ -425,6 +2784,7 @@ def resize_image():
         width = request.form.get('width')
         height = request.form.get('height')
         maintain_aspect_ratio = request.form.get('maintain_aspect_ratio', 'true').lower() == 'true'
+        resample = request.form.get('resample', 'lanczos')
         
         # Convert width and height to integers if provided
         width = int(width) if width else None
@@ -432,58 +2792,79 @@ def resize_image():
         
         if width is None and height is None:
             return jsonify({'error': 'Either width or height must be provided'}), 400
+        if (width is not None and width < 1) or (height is not None and height < 1):
+            raise ValueError
     except ValueError:
         return jsonify({'error': 'Invalid dimensions provided'}), 400
+    if resample not in RESAMPLE_FILTERS:
+        return jsonify({'error': f'Unknown resample filter: {resample}'}), 400
     
-    try:
-        # Open the image
-        img = Image.open(file)
-        
-        # Calculate new dimensions based on aspect ratio if needed
-        original_width, original_height = img.size
-        
-        if maintain_aspect_ratio:
-            aspect_ratio = original_width / original_height
-            
-            if width is None:
-                width = int(height * aspect_ratio)
-            elif height is None:
-                height = int(width / aspect_ratio)
-            else:
-                # Both width and height provided but maintain aspect ratio
-                # Use width as the reference and adjust height
-                height = int(width / aspect_ratio)
-        else:
-            # If not maintaining aspect ratio, use original dimensions for any missing value
-            width = width or original_width
-            height = height or original_height
+    def render():
+        # Open the image; with both dimensions and the aspect ratio kept, it fits within them
+        img = open_image(file.stream)
+        size = target_size(img.size, width, height, maintain_aspect_ratio)
         
         # Resize the image
-        resized_img = img.resize((width, height), Image.Resampling.LANCZOS)
-        
-        # Save to buffer
-        buffer = BytesIO()
-        resized_img.save(buffer, format='PNG')
-        buffer.seek(0)
-        
-        return send_file(buffer, mimetype='image/png')
+        with pixel_budget.reserve(img.width * img.height):
+            with timed('decode'):
+                img.load()
+            with timed('resize'):
+                return scale_image(img, size, resample, RESIZE_REDUCING_GAP)
+    
+    try:
+        return cached_image_response(
+            'resize-image', hash_stream(file.stream),
+            {'width': width, 'height': height, 'maintain_aspect_ratio': maintain_aspect_ratio,
+             'resample': resample},
+            render
+        )
     
     except Exception as e:
-        app.logger.error(f"Error resizing image: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        logger.error("Error resizing image: %s", e)
+        return error_response(e)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Return result and mask cache hit/miss counters and sizes, and temp store counters"""
+    return jsonify({'results': result_cache.stats(), 'masks': mask_cache.stats(), 'temp': temp_store.stats()})
 
 @app.route('/base-images')
 def list_base_images():
-    """Return list of base images"""
-    images = get_base_images()
-    return jsonify({
-        'images': [{'name': img, 'url': f'/base-img/{img}'} for img in images]
-    })
+    """Return the base images with their dimensions, hashes and thumbnail URLs.
+    The listing's ETag changes whenever any base image does."""
+    response = jsonify(base_image_catalog.listing())
+    response.set_etag(base_image_catalog.version)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/base-img/<path:filename>')
 def serve_base_image(filename):
-    """Serve base images"""
-    return send_file(Path(BASE_IMAGES_DIR) / filename)
+    """Serve base images. URLs from the listing carry the content hash as ?v=, so those
+    responses can be cached for good; others are revalidated against the hash ETag."""
+    entry = base_image_catalog.get(filename)
+    if entry is None:
+        # Other files in the directory, e.g. style-default.png
+        return send_from_directory(base_image_catalog.directory, filename, conditional=True, max_age=0)
+    versioned = request.args.get('v') == entry['hash']
+    response = send_file(base_image_catalog.directory / filename, etag=entry['hash'], conditional=True,
+                         max_age=IMMUTABLE_MAX_AGE if versioned else 0)
+    if versioned:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+@app.route('/base-thumbnails/<filename>')
+def serve_base_thumbnail(filename):
+    """Serve a base image thumbnail; names are <content hash>-<size>.png, so they never change"""
+    match = re.fullmatch(r'([0-9a-f]{16})-(\d+)\.png', filename)
+    base_image_catalog.entries()
+    path = match and base_image_catalog.thumbnail(match.group(1), int(match.group(2)))
+    if not path:
+        return jsonify({'error': 'Thumbnail not found'}), 404
+    response = send_file(path, etag=filename, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/generate')
 def generate():
@@ -511,15 +2892,12 @@ def process_comfyui():
         
         print(f"Parameters: base_image={base_image}, prompt={prompt}, steps={steps}, batch_size={batch_size}, weight_style={weight_style}")
         
-        # Save style image if provided
+        # Save style image if provided; a style image that was uploaded before is reused
         style_image_path = None
         if style_image:
-            # Create a safe filename from the original
-            safe_filename = secure_filename(style_image.filename)
-            # Create absolute path
-            style_image_path = str(Path.cwd() / 'temp' / safe_filename)
-            Path('temp').mkdir(exist_ok=True)
-            style_image.save(style_image_path)
+            name = temp_store.save(style_image.stream, style_image.filename)
+            # ComfyUI reads the file by absolute path
+            style_image_path = str(temp_store.path(name).resolve())
             print(f"Saved style image to {style_image_path}")
         
         print("2. Loading workflow...")
@@ -538,9 +2916,9 @@ def process_comfyui():
         )
         
         print("4. Sending to ComfyUI API...")
-        response = requests.post(f"{COMFYUI_API}/prompt", json={
+        response = comfy_client.post("/prompt", json={
             "prompt": modified_workflow,
-            "client_id": "background-remover"
+            "client_id": comfy_tracker.client_id
         })
         
         if not response.ok:
@@ -550,74 +2928,27 @@ def process_comfyui():
         prompt_id = response.json()['prompt_id']
         print(f"5. Got prompt ID: {prompt_id}")
         
-        # Poll for completion with exponential backoff
-        max_wait_time = 300  # 5 minutes timeout
-        initial_delay = 10   # Start with 10 second delay
-        max_delay = 10       # Cap delay at 10 seconds
-        current_delay = initial_delay
+        # Wait for the completion event from the websocket tracker (falls back to /history)
         start_time = time.time()
+        prompt_state = comfy_tracker.wait(prompt_id, timeout=300)  # 5 minutes timeout
+        if prompt_state['status'] == 'error':
+            raise Exception(f"ComfyUI Error: {prompt_state['error']}")
+        print(f"Prompt completed in {time.time() - start_time:.2f} seconds")
         
-        while (time.time() - start_time) < max_wait_time:
-            history_response = requests.get(f"{COMFYUI_API}/history")
-            if not history_response.ok:
-                print(f"Error getting history: {history_response.text}")
-                time.sleep(current_delay)
-                current_delay = min(current_delay * 1.5, max_delay)
-                continue
-                
-            history = history_response.json()
-            
-            if prompt_id not in history:
-                print(f"Prompt {prompt_id} not found in history yet")
-                time.sleep(current_delay)
-                current_delay = min(current_delay * 1.5, max_delay)
-                continue
-                
-            prompt_status = history[prompt_id]
-            
-            if 'error' in prompt_status:
-                raise Exception(f"ComfyUI Error: {prompt_status['error']}")
-                
-            if 'status' not in prompt_status:
-                time.sleep(current_delay)
-                current_delay = min(current_delay * 1.5, max_delay)
-                continue
-                
-            if prompt_status['status'].get('completed', False):
-                print(f"Prompt completed in {time.time() - start_time:.2f} seconds")
-                break
-                
-            # If execution_start exists, we can show progress
-            if 'status' in prompt_status and 'executing' in prompt_status['status']:
-                execution_node = prompt_status['status']['executing']['node']
-                print(f"Executing node: {execution_node}")
-            
-            time.sleep(current_delay)
-            current_delay = min(current_delay * 1.5, max_delay)
-        
-        if (time.time() - start_time) >= max_wait_time:
-            raise Exception("Timeout waiting for ComfyUI to process the workflow")
-        
-        # Get the output images
-        output_images = []
-        if 'outputs' in history[prompt_id]:
-            for node_id, node_output in history[prompt_id]['outputs'].items():
-                if 'images' in node_output:
-                    for image in node_output['images']:
-                        # Skip temporary preview images
-                        filename = image['filename']
-                        if not (filename.startswith('PB-_temp_') or 
-                               filename.startswith('ComfyUI_temp_')):
-                            image_url = f"{COMFYUI_API}/view?filename={filename}&subfolder={image.get('subfolder', '')}"
-                            output_images.append(image_url)
+        # Cached nodes don't emit 'executed' events, so confirm the outputs against history
+        prompt_state = comfy_tracker.status(prompt_id)
+        
+        # Get the output images, skipping temporary preview images
+        output_images = [
+            f"{COMFYUI_API}/view?filename={image['filename']}&subfolder={image.get('subfolder', '')}"
+            for image in collect_output_images(prompt_state['outputs'], skip_temp=True)
+        ]
         
         if not output_images:
             raise Exception("No images were generated")
         
-        # Clean up temporary files
-        if style_image_path:
-            Path(style_image_path).unlink(missing_ok=True)
-        
+        # The style image stays in the temp store, which expires it, since an identical
+        # upload in another request may share the same file
         return jsonify({'images': output_images})
         
     except Exception as e:
@@ -626,20 +2957,21 @@ def process_comfyui():
 
 @app.route('/save-temp-image', methods=['POST'])
 def save_temp_image():
-    if 'image' not in request.files:
+    """Save an uploaded image, or a ComfyUI output given by its /view URL ('comfyui_image'),
+    to temp/ and return its URL. The ComfyUI variant streams server-side, so the browser
+    doesn't have to download the image just to upload it again."""
+    comfyui_image = request.form.get('comfyui_image')
+    if 'image' not in request.files and not comfyui_image:
         return jsonify({'error': 'No image uploaded'}), 400
         
     try:
-        file = request.files['image']
-        # Create temp directory if it doesn't exist
-        Path('temp').mkdir(exist_ok=True)
-        
-        # Generate unique filename
-        filename = f"temp_{int(time.time())}_{secure_filename(file.filename)}"
-        filepath = Path('temp') / filename
-        
-        # Save the file
-        file.save(filepath)
+        # Files are named by content hash, so saving the same image twice stores it once
+        if comfyui_image:
+            ref = parse_comfyui_image_ref(comfyui_image)
+            filename = temp_store.save(lambda f: stream_comfyui_image(ref, f), ref['filename'])
+        else:
+            file = request.files['image']
+            filename = temp_store.save(file.stream, file.filename)
         
         # Return temporary URL
         return jsonify({
@@ -650,7 +2982,16 @@ def save_temp_image():
 
 @app.route('/temp/<path:filename>')
 def serve_temp_file(filename):
-    return send_file(Path('temp') / filename)
+    """Serve a temp store file. Names are content hashes, so the content behind a URL never
+    changes: the hash doubles as the ETag and the response may be cached until it expires.
+    send_file hands the open file to the server's file wrapper (sendfile under gunicorn)."""
+    path = temp_store.path(filename)
+    if path is None or not path.is_file():
+        return jsonify({'error': 'File not found'}), 404
+    response = send_file(path, etag=path.stem, conditional=True, max_age=temp_store.ttl)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/comfyui-generate', methods=['POST'])
 def generate_comfyui():
@@ -682,11 +3023,11 @@ def generate_comfyui():
         )
         
         # Queue the workflow
-        response = requests.post(
-            f"{COMFYUI_API}/prompt",
+        response = comfy_client.post(
+            "/prompt",
             json={
                 "prompt": modified_workflow,
-                "client_id": "background-remover"
+                "client_id": comfy_tracker.client_id
             }
         )
         
@@ -697,6 +3038,9 @@ def generate_comfyui():
         prompt_id = data.get('prompt_id')
         if not prompt_id:
             return jsonify({'error': 'No prompt ID received'}), 500
+        
+        # Follow progress over the websocket so /check-status can answer from memory
+        comfy_tracker.track(prompt_id)
             
         return jsonify({
             'prompt_id': prompt_id
@@ -706,27 +3050,147 @@ def generate_comfyui():
         print(f"Error in generate_comfyui: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def sse_event(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def pipeline_error(e):
+    """Log a generate pipeline failure with its traceback; returns the error payload to send.
+    Call from an except block."""
+    logger.exception("Error in generate pipeline")
+    return {'error': str(e)}
+
+def stream_generate_pipeline(prompt_id, settings):
+    """Yield server-sent events while a prompt generates, starting background removal on each
+    output image as soon as ComfyUI reports it, so GPU generation overlaps CPU segmentation"""
+    events = comfy_tracker.subscribe(prompt_id)
+    executor = get_batch_executor()
+    futures = {}
+    seen = set()
+    completed = errors = 0
+    finished = False
+    deadline = time.time() + COMFYUI_PIPELINE_TIMEOUT
+
+    def submit_new_images():
+        for image in collect_output_images(prompt_state['outputs']):
+            key = (image.get('subfolder', ''), image['filename'])
+            if key in seen:
+                continue
+            seen.add(key)
+            future = executor.submit(process_comfyui_image, parse_comfyui_image_ref(image), settings)
+            futures[future] = {'index': len(seen) - 1, 'filename': image['filename']}
+            future.add_done_callback(lambda f: events.put({'type': 'result', 'data': f}))
+
+    try:
+        yield sse_event('queued', {'prompt_id': prompt_id})
+        prompt_state = comfy_tracker.track(prompt_id)
+        submit_new_images()  # anything reported before we subscribed
+        if prompt_state['done'].is_set():
+            events.put({'type': 'finished', 'data': {}})
+
+        # Keep going until the 'finished' event has been handled (not merely the state flag set,
+        # or outputs reported just before it could be skipped) and every image has been sent
+        while not finished or completed + errors < len(futures):
+            if time.time() > deadline:
+                raise TimeoutError("Timeout waiting for the generate pipeline")
+            try:
+                event = events.get(timeout=COMFYUI_HISTORY_POLL_INTERVAL)
+            except queue.Empty:
+                # No news for a while; make sure a completion event wasn't missed
+                comfy_tracker.refresh_from_history(prompt_id)
+                submit_new_images()
+                continue
+
+            if event['type'] == 'result':
+                future = event['data']
+                info = futures[future]
+                try:
+                    png = future.result()
+                except Exception as e:
+                    errors += 1
+                    yield sse_event('image_error', {**info, 'error': str(e)})
+                else:
+                    completed += 1
+                    yield sse_event('image', {
+                        **info,
+                        'image': 'data:image/png;base64,' + base64.b64encode(png).decode(),
+                    })
+            elif event['type'] == 'progress':
+                yield sse_event('progress', event['data'])
+            elif event['type'] == 'finished':
+                finished = True
+                if prompt_state['status'] == 'error':
+                    yield sse_event('error', {'error': prompt_state['error']})
+                    return
+                # Pick up outputs of cached nodes, which don't emit 'executed' events
+                comfy_tracker.status(prompt_id)
+                submit_new_images()
+            else:
+                submit_new_images()
+
+        yield sse_event('done', {'prompt_id': prompt_id, 'images': completed, 'errors': errors})
+    except Exception as e:
+        yield sse_event('error', pipeline_error(e))
+    finally:
+        comfy_tracker.unsubscribe(prompt_id, events)
+        for future in futures:
+            future.cancel()
+
+@app.route('/comfyui-generate/remove-background', methods=['POST'])
+def generate_and_remove_background():
+    """Generate images with ComfyUI and remove their backgrounds as they arrive.
+    Takes the /comfyui-generate form fields plus a 'settings' JSON object for process_image,
+    and streams server-sent events: queued, progress, image (base64 PNG data URL),
+    image_error, then done (or error).
+    """
+    try:
+        settings = json.loads(request.form.get('settings', '{}'))
+        workflow = load_workflow(GENERATE_WORKFLOW_FILE)
+        modified_workflow = modify_generate_workflow(
+            workflow,
+            prompt=request.form.get('prompt', ''),
+            negative_prompt=request.form.get('negative_prompt', ''),
+            steps=int(request.form.get('steps', 10)),
+            batch_size=int(request.form.get('batch_size', 1)),
+            cfg=float(request.form.get('cfg', 4)),
+            checkpoint=request.form.get('checkpoint', None),
+            width=int(request.form.get('width', 800)),
+            height=int(request.form.get('height', 800))
+        )
+        
+        response = comfy_client.post("/prompt", json={
+            "prompt": modified_workflow,
+            "client_id": comfy_tracker.client_id
+        })
+        if not response.ok:
+            return jsonify({'error': 'Failed to queue workflow'}), 500
+        prompt_id = response.json().get('prompt_id')
+        if not prompt_id:
+            return jsonify({'error': 'No prompt ID received'}), 500
+        comfy_tracker.track(prompt_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify(pipeline_error(e)), 500
+    
+    return Response(stream_generate_pipeline(prompt_id, settings), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/check-status/<prompt_id>', methods=['GET'])
 def check_status(prompt_id):
     try:
-        history_response = requests.get(f"{COMFYUI_API}/history")
-        if not history_response.ok:
-            return jsonify({'status': 'pending'})
-            
-        history = history_response.json()
-        if prompt_id not in history:
+        # Answered from the websocket tracker's memory; only unknown prompts (or a
+        # disconnected socket) cost a /history/<prompt_id> request
+        prompt_state = comfy_tracker.status(prompt_id)
+        if prompt_state is None:
             return jsonify({'status': 'pending'})
-            
-        prompt_info = history[prompt_id]
         
         # Check if completed
-        if 'outputs' in prompt_info:
-            output_images = []
-            for node_id, node_output in prompt_info['outputs'].items():
-                if 'images' in node_output:
-                    for image in node_output['images']:
-                        image_url = f"{COMFYUI_API}/view?filename={image['filename']}&type=temp"
-                        output_images.append(image_url)
+        if prompt_state['status'] == 'completed':
+            output_images = [
+                f"{COMFYUI_API}/view?filename={image['filename']}&type=temp"
+                for image in collect_output_images(prompt_state['outputs'])
+            ]
             
             if output_images:
                 return jsonify({
@@ -734,12 +3198,71 @@ def check_status(prompt_id):
                     'images': output_images
                 })
         
-        return jsonify({'status': 'pending'})
+        return jsonify({'status': 'pending', 'progress': prompt_state['progress']})
         
     except Exception as e:
         print(f"Error checking status: {str(e)}")
         return jsonify({'status': 'pending'})
 
+@app.route('/comfyui-remove-background', methods=['POST'])
+def comfyui_remove_background():
+    """Remove backgrounds from ComfyUI output images without a browser round trip.
+    JSON body: 'images' (ComfyUI /view URLs or {filename, subfolder, type} dicts) or 'prompt_id'
+    (all images that prompt produced), 'settings' for process_image, and 'format': 'zip' (default),
+    'multipart', or 'png' for a single image. Images are streamed from ComfyUI in chunks and
+    processed on the batch worker pool.
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        settings = body.get('settings', {})
+        response_format = body.get('format', 'zip')
+        if response_format not in ('zip', 'multipart', 'png'):
+            return jsonify({'error': f'Unsupported format: {response_format}'}), 400
+        
+        if body.get('prompt_id'):
+            prompt_state = comfy_tracker.status(body['prompt_id'])
+            if prompt_state is None or prompt_state['status'] != 'completed':
+                return jsonify({'error': 'Prompt has not completed'}), 409
+            refs = [parse_comfyui_image_ref(image) for image in collect_output_images(prompt_state['outputs'])]
+        else:
+            refs = [parse_comfyui_image_ref(image) for image in body.get('images', [])]
+        
+        if not refs:
+            return jsonify({'error': 'No images provided'}), 400
+        if len(refs) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Too many images (max {BATCH_MAX_ITEMS})'}), 400
+        if response_format == 'png' and len(refs) != 1:
+            return jsonify({'error': "format 'png' requires exactly one image"}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if response_format == 'png':
+        try:
+            return Response(process_comfyui_image(refs[0], settings), mimetype='image/png')
+        except Exception as e:
+            logger.exception("Error processing ComfyUI image")
+            return jsonify({'error': str(e)}), 500
+    
+    executor = get_batch_executor()
+    names = [ref['filename'] for ref in refs]
+    futures = {executor.submit(process_comfyui_image, ref, settings): index
+               for index, ref in enumerate(refs)}
+    
+    if response_format == 'multipart':
+        boundary = uuid.uuid4().hex
+        return Response(stream_batch_multipart(names, futures, boundary),
+                        mimetype=f'multipart/mixed; boundary={boundary}')
+    return Response(stream_batch_zip(names, futures), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename="background-removed.zip"'})
+
+@app.route('/comfyui-metrics', methods=['GET'])
+def comfyui_metrics():
+    """Return per-endpoint latency and error counts for calls made to ComfyUI"""
+    return jsonify({
+        'endpoints': comfy_client.metrics(),
+        'websocket_connected': comfy_tracker.connected.is_set(),
+    })
+
 @app.route('/checkpoints', methods=['GET'])
 def get_checkpoints():
     """Get list of available checkpoints from ComfyUI"""
@@ -747,7 +3270,7 @@ def get_checkpoints():
         print("Fetching checkpoints from ComfyUI...")
         # First check if ComfyUI is accessible
         try:
-            response = requests.get(f"{COMFYUI_API}/object_info", timeout=5)
+            response = comfy_client.get("/object_info", timeout=5)
         except requests.exceptions.ConnectionError:
             print("ComfyUI is not accessible")
             return jsonify({
@@ -791,7 +3314,7 @@ def get_checkpoints():
 def interrupt_generation():
     """Interrupt the current generation process"""
     try:
-        response = requests.post(f"{COMFYUI_API}/interrupt")
+        response = comfy_client.post("/interrupt")
         if not response.ok:
             return jsonify({'error': 'Failed to interrupt generation'}), 500
         return jsonify({'status': 'success'})
@@ -799,6 +3322,73 @@ def interrupt_generation():
         print(f"Error interrupting generation: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    g.request_timings = []
+    _request_timings.set(g.request_timings)
+
+@app.after_request
+def record_request_timing(response):
+    """Count the request, log its stage timings as one JSON line and, with SERVER_TIMING
+    enabled, return them in a Server-Timing header. Streamed bodies are timed up to the
+    start of the response."""
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics_registry.inc('requests_total', {'endpoint': endpoint, 'status': response.status_code})
+    metrics_registry.observe('request_seconds', {'endpoint': endpoint}, elapsed)
+
+    stages = {}
+    for stage, seconds in g.request_timings:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+    if stages:
+        logger.info(json.dumps({
+            'event': 'request_timing',
+            'method': request.method,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'total_ms': round(elapsed * 1000, 2),
+            'stages_ms': {stage: round(seconds * 1000, 2) for stage, seconds in stages.items()},
+        }))
+    if SERVER_TIMING:
+        entries = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in stages.items()]
+        entries.append(f'total;dur={elapsed * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(entries)
+        # Lets the frontend's devtools show the timings on cross-origin requests
+        response.headers['Timing-Allow-Origin'] = 'http://localhost:3000'
+    return response
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once the preloaded models have loaded, 503 while pending or if any failed"""
+    status = model_preloader.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text-format metrics: request and stage histograms, per-model counters,
+    and current cache, job queue and pixel budget levels"""
+    gauges = [
+        ('result_cache_bytes', 'Bytes held in the in-memory result cache', result_cache.stats()['memory_bytes']),
+        ('mask_cache_bytes', 'Bytes held in the mask cache', mask_cache.stats()['memory_bytes']),
+        ('temp_store_bytes', 'Bytes in the temp store as of its last save or sweep', temp_store.stats()['bytes']),
+        ('job_queue_depth', 'Async jobs waiting to run', job_queue.depth()),
+        ('inflight_pixels', 'Decoded pixels currently reserved from the pixel budget', pixel_budget.in_use()),
+        ('loaded_models', 'Model sessions currently loaded', len(session_pool.loaded_models())),
+    ]
+    lines = [metrics_registry.render()]
+    for name, help_text, value in gauges:
+        lines.append(f"# HELP bgremover_{name} {help_text}\n# TYPE bgremover_{name} gauge\n"
+                     f"bgremover_{name} {value}\n")
+    return Response(''.join(lines), mimetype='text/plain; version=0.0.4')
+
 @app.after_request
 def after_request(response):
     # Ensure CORS headers are set for all responses
@@ -809,4 +3399,7 @@ def after_request(response):
     return response
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server only; serve production traffic with gunicorn -c gunicorn.conf.py app:app
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    app.run(host=os.environ.get('HOST', '127.0.0.1'), port=int(os.environ.get('PORT', 5000)),
+            debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)
@@ -0,0 +1,108 @@
+"""Benchmark fit_to_canvas against the previous PIL implementation.
+
+Usage (from the repository root):
+    python benchmarks/bench_fit_to_canvas.py [--size 3840x2160] [--repeat 5]
+
+For each case it reports the median time of the old and new implementations and the
+largest per-channel difference between their outputs (colors premultiplied by alpha).
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app import fit_to_canvas  # noqa: E402
+
+
+def legacy_fit_to_canvas(image, padding_percent):
+    """fit_to_canvas as it was before the array-based rewrite, kept as the reference"""
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    canvas_width, canvas_height = image.size
+    if padding_percent == 0:
+        bbox = image.getchannel('A').getbbox()
+        if not bbox:
+            return image
+        content_width, content_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        scale = min(canvas_width / content_width, canvas_height / content_height)
+        target_width, target_height = canvas_width, canvas_height
+    else:
+        alpha = image.getchannel('A')
+        if alpha.getextrema()[0] < 255:
+            bbox = alpha.getbbox()
+            if bbox is None:
+                return image
+            content_width, content_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+            target_width = int(canvas_width * (1 - padding_percent / 100))
+            target_height = int(canvas_height * (1 - padding_percent / 100))
+            scale = min(target_width / content_width, target_height / content_height)
+        else:
+            target_width = int(canvas_width * (1 - padding_percent / 100))
+            target_height = int(canvas_height * (1 - padding_percent / 100))
+            new_image = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
+            resized = image.resize((target_width, target_height), Image.Resampling.LANCZOS)
+            new_image.paste(resized, ((canvas_width - target_width) // 2, (canvas_height - target_height) // 2))
+            return new_image
+    final_width, final_height = int(content_width * scale), int(content_height * scale)
+    new_image = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
+    resized = image.crop(bbox).resize((final_width, final_height), Image.Resampling.LANCZOS)
+    new_image.paste(resized, ((canvas_width - final_width) // 2, (canvas_height - final_height) // 2))
+    return new_image
+
+
+def make_image(width, height, transparent):
+    """Noisy RGBA image; when transparent, an opaque ellipse with a soft edge on a clear background"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    if transparent:
+        yy, xx = np.mgrid[0:height, 0:width]
+        distance = ((xx - width / 2) / (width * 0.3)) ** 2 + ((yy - height / 2) / (height * 0.35)) ** 2
+        pixels[:, :, 3] = np.clip((1.1 - distance) * 10 * 255, 0, 255).astype(np.uint8)
+    else:
+        pixels[:, :, 3] = 255
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def premultiplied(image):
+    """Colors weighted by alpha, so differences in the color of near-invisible pixels don't count"""
+    pixels = np.asarray(image).astype(np.int32)
+    pixels[:, :, :3] = pixels[:, :, :3] * pixels[:, :, 3:4] // 255
+    return pixels
+
+
+def median_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='3840x2160', help='Image size as WIDTHxHEIGHT')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split('x'))
+
+    print(f"{'case':<30} {'legacy ms':>10} {'new ms':>10} {'speedup':>8} {'max diff':>9}")
+    for transparent in (True, False):
+        image = make_image(width, height, transparent)
+        for padding in (0, 20):
+            for resample in ('lanczos', 'area'):
+                legacy_s, expected = median_time(lambda: legacy_fit_to_canvas(image, padding), args.repeat)
+                new_s, actual = median_time(lambda: fit_to_canvas(image, padding, resample=resample), args.repeat)
+                max_diff = int(np.abs(premultiplied(expected) - premultiplied(actual)).max())
+                case = f"{'alpha' if transparent else 'opaque'} pad={padding} {resample}"
+                print(f"{case:<30} {legacy_s * 1000:>10.1f} {new_s * 1000:>10.1f} "
+                      f"{legacy_s / new_s:>7.2f}x {max_diff:>9}")
+
+
+if __name__ == '__main__':
+    main()
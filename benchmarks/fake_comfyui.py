@@ -0,0 +1,184 @@
+"""Minimal stand-in for a ComfyUI server, for benchmarks and local testing without a GPU.
+
+Implements the parts of the API the app uses: POST /prompt, GET /history[/<id>], GET /view,
+GET /object_info, POST /interrupt and the /ws websocket (execution_start, progress, executed
+and the final executing node=None events). Every prompt "runs" for `delay` seconds and
+produces `images` small PNGs.
+
+Usage:
+    fake = FakeComfyUI(delay=0.5, images=2)
+    app.comfy_client.api_url = fake.url
+    ...
+    fake.close()
+
+Or standalone: python benchmarks/fake_comfyui.py [--port 8188] [--delay 0.5]
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class FakeComfyUI:
+    def __init__(self, delay=0.5, images=1, websocket=True, port=0, image_size=(512, 512)):
+        self.delay = delay
+        self.images = images
+        self.websocket = websocket
+        self.history = {}
+        self.requests = []  # (method, path) of every HTTP request received
+        self._sockets = {}  # client_id -> (wfile, closed event)
+        self._lock = threading.Lock()
+
+        buffer = io.BytesIO()
+        Image.new('RGB', image_size, (120, 200, 40)).save(buffer, 'PNG')
+        self._image = buffer.getvalue()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, name='fake-comfyui', daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            for _, closed in self._sockets.values():
+                closed.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request_count(self, path_prefix=''):
+        return sum(1 for _, path in self.requests if path.startswith(path_prefix))
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_body(self, body, content_type, status=200):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, obj, status=200):
+                self.send_body(json.dumps(obj).encode(), 'application/json', status)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                fake.requests.append(('GET', url.path))
+                if url.path == '/ws' and fake.websocket:
+                    return fake._accept_websocket(self, parse_qs(url.query).get('clientId', [''])[0])
+                if url.path == '/history':
+                    return self.send_json(fake.history)
+                if url.path.startswith('/history/'):
+                    prompt_id = url.path.rsplit('/', 1)[-1]
+                    entry = fake.history.get(prompt_id)
+                    return self.send_json({prompt_id: entry} if entry else {})
+                if url.path == '/view':
+                    return self.send_body(fake._image, 'image/png')
+                if url.path == '/object_info':
+                    return self.send_json({'CheckpointLoaderSimple': {'input': {'required': {
+                        'ckpt_name': [['fake.safetensors']]}}}})
+                self.send_json({}, 404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                fake.requests.append(('POST', url.path))
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if url.path == '/prompt':
+                    request = json.loads(body or b'{}')
+                    prompt_id = uuid.uuid4().hex
+                    threading.Thread(target=fake._run, args=(prompt_id, request.get('client_id')),
+                                     daemon=True).start()
+                    return self.send_json({'prompt_id': prompt_id, 'number': 1})
+                if url.path == '/interrupt':
+                    return self.send_json({})
+                self.send_json({}, 404)
+
+        return Handler
+
+    def _accept_websocket(self, handler, client_id):
+        """Complete the websocket handshake and hold the connection until close()"""
+        key = handler.headers['Sec-WebSocket-Key']
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        handler.send_response(101)
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', accept)
+        handler.end_headers()
+        handler.wfile.flush()
+        closed = threading.Event()
+        with self._lock:
+            self._sockets[client_id] = (handler.wfile, closed)
+        closed.wait()
+        handler.close_connection = True
+
+    def _send(self, client_id, message):
+        """Send a JSON text frame to the client's websocket, if it has one"""
+        with self._lock:
+            socket = self._sockets.get(client_id)
+        if socket is None:
+            return
+        data = json.dumps(message).encode()
+        if len(data) < 126:
+            header = b'\x81' + bytes([len(data)])
+        else:
+            header = b'\x81\x7e' + struct.pack('>H', len(data))
+        try:
+            socket[0].write(header + data)
+            socket[0].flush()
+        except OSError:
+            pass
+
+    def _run(self, prompt_id, client_id):
+        self._send(client_id, {'type': 'execution_start', 'data': {'prompt_id': prompt_id}})
+        images = []
+        for i in range(self.images):
+            time.sleep(self.delay / max(self.images, 1))
+            image = {'filename': f'fake_{prompt_id}_{i}.png', 'subfolder': '', 'type': 'output'}
+            images.append(image)
+            self._send(client_id, {'type': 'progress', 'data': {
+                'prompt_id': prompt_id, 'node': '3', 'value': i + 1, 'max': self.images}})
+            self._send(client_id, {'type': 'executed', 'data': {
+                'prompt_id': prompt_id, 'node': '9', 'output': {'images': [image]}}})
+        self.history[prompt_id] = {
+            'prompt': [],
+            'outputs': {'9': {'images': images}},
+            'status': {'status_str': 'success', 'completed': True, 'messages': []},
+        }
+        self._send(client_id, {'type': 'executing', 'data': {'prompt_id': prompt_id, 'node': None}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake ComfyUI server')
+    parser.add_argument('--port', type=int, default=8188)
+    parser.add_argument('--delay', type=float, default=0.5, help='Seconds each prompt takes')
+    parser.add_argument('--images', type=int, default=1, help='Images produced per prompt')
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(delay=args.delay, images=args.images, port=args.port)
+    print(f"Fake ComfyUI listening on {fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Load test for the production server: requests/sec as the number of gunicorn workers grows.
+
+Usage (from the repository root, with gunicorn installed):
+    python benchmarks/loadtest.py [--workers 1,2,4] [--threads 4] [--clients 16]
+        [--duration 30] [--endpoint remove-background|fit-to-canvas] [--size 1024x768]
+        [--model u2net] [--output results.json]
+
+For each worker count, starts `gunicorn -c gunicorn.conf.py app:app` on a free local port
+with the result and mask caches disabled. The server preloads the model and waits for
+/readyz. Then --clients concurrent clients post the same image for --duration seconds.
+Reports requests/sec, p50/p95 latency and errors per worker count, and the speedup over the
+first. fit-to-canvas needs no model, so it measures the serving overhead alone.
+
+Pass --url to load test an already running server instead (one run, no scaling).
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+READY_TIMEOUT = 300  # seconds to wait for a server's models to load
+
+
+def make_image(width, height):
+    """Seeded noisy gradient with an opaque ellipse on a transparent background, as PNG bytes"""
+    rng = np.random.default_rng(width * 31 + height)
+    yy, xx = np.mgrid[0:height, 0:width]
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[:, :, 0] = xx * 255 // max(width - 1, 1)
+    pixels[:, :, 1] = yy * 255 // max(height - 1, 1)
+    pixels[:, :, 2] = rng.integers(60, 120, (height, width))
+    distance = ((xx - width / 2) / (width * 0.3)) ** 2 + ((yy - height / 2) / (height * 0.35)) ** 2
+    pixels[:, :, 3] = np.where(distance < 1, 255, 0)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, 'RGBA').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def request_fields(endpoint, model):
+    if endpoint == 'remove-background':
+        settings = {'model': model, 'foreground_threshold': 50, 'erode_size': 3}
+        return {'settings': json.dumps(settings)}
+    return {'padding': '10'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers, threads, model, endpoint):
+    """Start gunicorn with the given worker count and wait until it reports ready"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_THREADS=str(threads),
+        BIND=f'127.0.0.1:{port}',
+        RESULT_CACHE_MAX_BYTES='0',
+        RESULT_CACHE_DIR='',
+        MASK_CACHE_MAX_BYTES='0',
+        LOG_LEVEL='warning',
+    )
+    if endpoint == 'remove-background':
+        env['REMBG_PRELOAD_MODELS'] = model
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '/dev/null', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + READY_TIMEOUT
+    # Every worker must be ready, but each check reaches only one of them, so require a
+    # run of consecutive ready responses
+    ready_streak = 0
+    while ready_streak < workers * 3:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError(f'Server not ready after {READY_TIMEOUT}s')
+        try:
+            ready = requests.get(f'{url}/readyz', timeout=2).status_code == 200
+        except requests.RequestException:
+            ready = False
+        ready_streak = ready_streak + 1 if ready else 0
+        time.sleep(0.05 if ready else 0.5)
+    return process, url
+
+
+def load(url, endpoint, fields, image, clients, duration):
+    """Have clients post image as fast as they can for duration seconds"""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        with requests.Session() as session:
+            # One warm-up request per client so connection setup and lazy loads aren't timed
+            session.post(f'{url}/{endpoint}', data=fields, files={'image': ('load.png', image)})
+            while time.perf_counter() < stop_at:
+                start = time.perf_counter()
+                try:
+                    response = session.post(f'{url}/{endpoint}', data=fields,
+                                            files={'image': ('load.png', image)}, timeout=300)
+                    ok = response.status_code == 200
+                    error = None if ok else f'HTTP {response.status_code}'
+                except requests.RequestException as e:
+                    error = type(e).__name__
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if error:
+                        errors.append(error)
+                    else:
+                        latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        for future in [executor.submit(client) for _ in range(clients)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 1) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure requests/sec against gunicorn worker count')
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='Threads per worker')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load per worker count')
+    parser.add_argument('--endpoint', choices=('remove-background', 'fit-to-canvas'), default='remove-background')
+    parser.add_argument('--size', default='1024x768', help='Test image size, WIDTHxHEIGHT')
+    parser.add_argument('--model', default='u2net')
+    parser.add_argument('--url', help='Load test this running server instead of starting gunicorn')
+    parser.add_argument('--output', type=Path, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    image = make_image(width, height)
+    fields = request_fields(args.endpoint, args.model)
+
+    results = []
+    if args.url:
+        result = load(args.url.rstrip('/'), args.endpoint, fields, image, args.clients, args.duration)
+        results.append(dict(result, workers=None))
+    else:
+        for workers in (int(w) for w in args.workers.split(',')):
+            process, url = start_server(workers, args.threads, args.model, args.endpoint)
+            try:
+                result = load(url, args.endpoint, fields, image, args.clients, args.duration)
+            finally:
+                process.terminate()
+                process.wait()
+            results.append(dict(result, workers=workers))
+
+    base_rps = results[0]['rps'] or None
+    print(f"{args.endpoint} {args.size}, {args.clients} clients, {args.duration:g}s per run, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'speedup':>8}")
+    for result in results:
+        result['speedup'] = round(result['rps'] / base_rps, 2) if base_rps else None
+        print(f"{result['workers'] or '-':>8} {result['requests']:>9} {result['errors']:>7} {result['rps']:>8} "
+              f"{result['p50_ms'] or '-':>8} {result['p95_ms'] or '-':>8} {result['speedup'] or '-':>8}")
+
+    if args.output:
+        args.output.write_text(json.dumps({
+            'endpoint': args.endpoint, 'size': args.size, 'clients': args.clients,
+            'duration': args.duration, 'threads': args.threads, 'cpus': os.cpu_count(),
+            'results': results,
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
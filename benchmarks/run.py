@@ -0,0 +1,356 @@
+"""Benchmark suite for the image pipeline and the ComfyUI orchestration paths.
+
+Usage (from the repository root):
+    python benchmarks/run.py [--suites fit,resize,encode,remove,workflow,comfyui]
+        [--sizes 640x480,1920x1080,3840x2160] [--remove-sizes 640x480,1920x1080]
+        [--models u2net,silueta] [--repeat 5] [--output results.json] [--compare old.json]
+
+Inputs are seeded synthetic images, opaque and with a soft-edged transparent subject, so
+runs are reproducible. The result and mask caches are disabled so every iteration does the
+work. ComfyUI paths run against benchmarks/fake_comfyui.py, whose prompts take a fixed
+--comfy-delay, so the reported overhead is what the app adds on top.
+
+Each case reports p50/p95/mean latency, throughput and peak RSS (reset per case where the
+kernel allows it). Results are written as JSON to benchmarks/results/ unless --output is
+given; --compare prints the p50 change against an earlier run's file.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+os.chdir(ROOT)  # workflows and base images are resolved relative to the repository root
+
+import app  # noqa: E402
+from fake_comfyui import FakeComfyUI  # noqa: E402
+
+SUITES = ('fit', 'resize', 'encode', 'remove', 'workflow', 'comfyui')
+
+
+def make_image(width, height, transparent):
+    """Noisy RGBA image; when transparent, an opaque ellipse with a soft edge on a clear background"""
+    rng = np.random.default_rng(width * 31 + height)
+    yy, xx = np.mgrid[0:height, 0:width]
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    # Smooth gradients plus noise compress more like photos than pure noise does
+    pixels[:, :, 0] = xx * 255 // max(width - 1, 1)
+    pixels[:, :, 1] = yy * 255 // max(height - 1, 1)
+    pixels[:, :, 2] = 90
+    noise = rng.integers(-8, 9, (height, width, 3))
+    pixels[:, :, :3] = np.clip(pixels[:, :, :3] + noise, 0, 255)
+    if transparent:
+        distance = ((xx - width / 2) / (width * 0.3)) ** 2 + ((yy - height / 2) / (height * 0.35)) ** 2
+        pixels[:, :, 3] = np.clip((1.1 - distance) * 10 * 255, 0, 255).astype(np.uint8)
+    else:
+        pixels[:, :, 3] = 255
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def encode(image, fmt='PNG'):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (Linux only); returns whether it worked"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Lifetime peak; kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Runner:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, suite, case, fn, repeat=None, warmup=1, pixels=None, **extra):
+        """Time fn() repeat times after warmup calls and record the summary.
+        Exceptions during warmup mark the case as skipped instead of aborting the run."""
+        repeat = repeat or self.repeat
+        try:
+            for _ in range(warmup):
+                fn()
+        except Exception as e:
+            print(f"{suite:<9} {case:<44} skipped: {e}")
+            self.results.append({'suite': suite, 'case': case, 'skipped': str(e)})
+            return None
+
+        rss_reset = reset_peak_rss()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+
+        result = {
+            'suite': suite,
+            'case': case,
+            'n': repeat,
+            'p50_ms': statistics.median(times) * 1000,
+            'p95_ms': percentile(times, 0.95) * 1000,
+            'mean_ms': statistics.fmean(times) * 1000,
+            'throughput_per_s': repeat / sum(times),
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_is_per_case': rss_reset,
+        }
+        if pixels:
+            result['megapixels_per_s'] = pixels * repeat / sum(times) / 1e6
+        result.update(extra)
+        self.results.append(result)
+        print(f"{suite:<9} {case:<44} p50 {result['p50_ms']:>10.3f}ms  p95 {result['p95_ms']:>10.3f}ms  "
+              f"{result['throughput_per_s']:>8.1f}/s  rss {result['peak_rss_mb']:>7.0f}MB")
+        return result
+
+
+def bench_fit(runner, sizes):
+    for width, height in sizes:
+        for transparent in (True, False):
+            image = make_image(width, height, transparent)
+            for resample in ('lanczos', 'area'):
+                case = f"{width}x{height} {'alpha' if transparent else 'opaque'} pad=10 {resample}"
+                runner.run('fit', case, lambda: app.fit_to_canvas(image, 10, resample=resample),
+                           pixels=width * height)
+
+
+def bench_resize(runner, sizes):
+    client = app.app.test_client()
+    for width, height in sizes:
+        image = make_image(width, height, True)
+        target = (max(1, width // 2), max(1, height // 2))
+        # The resize step process_image applies after background removal, against a
+        # plain one-shot PIL resize for reference
+        runner.run('resize', f"{width}x{height} pil lanczos -> {target[0]}x{target[1]}",
+                   lambda: image.resize(target, Image.Resampling.LANCZOS), pixels=width * height)
+        runner.run('resize', f"{width}x{height} scale_image -> {target[0]}x{target[1]}",
+                   lambda: app.scale_image(image, target), pixels=width * height)
+
+        # Large downscales are where the optional reducing-gap pre-reduction pays off
+        small = app.target_size(image.size, 256, 256, True)
+        runner.run('resize', f"{width}x{height} pil lanczos -> {small[0]}x{small[1]}",
+                   lambda: image.resize(small, Image.Resampling.LANCZOS), pixels=width * height)
+        runner.run('resize', f"{width}x{height} scale_image -> {small[0]}x{small[1]}",
+                   lambda: app.scale_image(image, small), pixels=width * height)
+        runner.run('resize', f"{width}x{height} scale_image gap=3 -> {small[0]}x{small[1]}",
+                   lambda: app.scale_image(image, small, reducing_gap=3.0), pixels=width * height)
+
+        data = encode(image)
+
+        def post():
+            response = client.post('/resize-image', data={
+                'image': (io.BytesIO(data), 'bench.png'), 'width': str(target[0]),
+            })
+            if response.status_code != 200:
+                raise RuntimeError(f"/resize-image returned {response.status_code}")
+
+        runner.run('resize', f"{width}x{height} /resize-image -> width {target[0]}", post,
+                   pixels=width * height)
+
+
+def bench_encode(runner, sizes):
+    encodings = {
+        'png level 6': {'format': 'png', 'compress_level': 6},
+        'png level 1': {'format': 'png', 'compress_level': 1},
+        'webp lossless': {'format': 'webp', 'lossless': True},
+        'webp q90': {'format': 'webp', 'quality': 90},
+    }
+    for width, height in sizes:
+        for transparent in (True, False):
+            image = make_image(width, height, transparent)
+            for name, encoding in encodings.items():
+                def run():
+                    buffer = io.BytesIO()
+                    app.encode_image(image, buffer, encoding)
+                    return buffer
+
+                size = len(run().getvalue())
+                case = f"{width}x{height} {'alpha' if transparent else 'opaque'} {name}"
+                runner.run('encode', case, run, warmup=0, pixels=width * height, output_bytes=size)
+
+
+def bench_remove(runner, sizes, models):
+    from rembg import remove
+    for model in models:
+        for width, height in sizes:
+            image = make_image(width, height, False).convert('RGB')
+
+            def run():
+                session = app.get_session(model)
+                return remove(image, session=session, alpha_matting=True,
+                              alpha_matting_foreground_threshold=240, alpha_matting_erode_size=10)
+
+            # The warmup call also loads the model, so it is excluded from the timings
+            runner.run('remove', f"{model} {width}x{height} alpha_matting", run,
+                       repeat=max(1, runner.repeat // 2), pixels=width * height)
+
+
+def bench_workflow(runner):
+    workflow = app.load_workflow(app.STYLIZE_WORKFLOW_FILE)
+    generate = app.load_workflow(app.GENERATE_WORKFLOW_FILE)
+    repeat = runner.repeat * 200  # microsecond-scale, so many more iterations
+    runner.run('workflow', 'load_workflow (cached)',
+               lambda: app.load_workflow(app.STYLIZE_WORKFLOW_FILE), repeat=repeat)
+    runner.run('workflow', 'modify_workflow', lambda: app.modify_workflow(
+        workflow, style_image_path='/tmp/style.png', base_image='base.png', prompt='a ring',
+        negative_prompt='blurry', steps=20, batch_size=4, weight_style=0.6), repeat=repeat)
+    runner.run('workflow', 'modify_generate_workflow', lambda: app.modify_generate_workflow(
+        generate, prompt='a ring', negative_prompt='blurry', steps=10, batch_size=4, cfg=4,
+        width=800, height=800), repeat=repeat)
+
+
+def bench_comfyui(runner, delay, poll_interval):
+    fake = FakeComfyUI(delay=delay, images=2)
+    app.COMFYUI_API = fake.url
+    app.comfy_client.api_url = fake.url
+    app.comfy_tracker.api_url = fake.url
+    client = app.app.test_client()
+    repeat = max(3, runner.repeat)
+    try:
+        def generate_and_poll():
+            response = client.post('/comfyui-generate', data={'prompt': 'benchmark', 'steps': '1'})
+            prompt_id = response.get_json()['prompt_id']
+            # The same loop the frontend runs against /check-status
+            while client.get(f'/check-status/{prompt_id}').get_json()['status'] != 'completed':
+                time.sleep(poll_interval)
+
+        before = fake.request_count('/history')
+        result = runner.run('comfyui', f"generate + /check-status every {poll_interval * 1000:.0f}ms",
+                            generate_and_poll, repeat=repeat, prompt_seconds=delay)
+        if result:
+            result['overhead_p50_ms'] = result['p50_ms'] - delay * 1000
+            result['history_requests_per_prompt'] = (fake.request_count('/history') - before) / (repeat + 1)
+
+        def process_blocking():
+            response = client.post('/comfyui-process', data={'base_image': 'bench.png', 'prompt': 'benchmark'})
+            if response.status_code != 200:
+                raise RuntimeError(f"/comfyui-process returned {response.status_code}")
+
+        result = runner.run('comfyui', '/comfyui-process (blocking wait)', process_blocking,
+                            repeat=repeat, prompt_seconds=delay)
+        if result:
+            result['overhead_p50_ms'] = result['p50_ms'] - delay * 1000
+    finally:
+        fake.close()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print the p50 change of each case that also appears in the baseline run"""
+    baseline = {(r['suite'], r['case']): r for r in json.loads(Path(baseline_path).read_text())['results']}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get((result['suite'], result['case']))
+        if not old or 'p50_ms' not in old or 'p50_ms' not in result:
+            continue
+        change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+        print(f"{result['suite']:<9} {result['case']:<44} {old['p50_ms']:>10.3f} -> "
+              f"{result['p50_ms']:>10.3f}ms ({change:+.1f}%)")
+
+
+def parse_sizes(value):
+    return [tuple(int(v) for v in size.lower().split('x')) for size in value.split(',') if size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--suites', default=','.join(SUITES), help='Comma-separated suites to run')
+    parser.add_argument('--sizes', default='640x480,1920x1080,3840x2160', help='Image sizes as WIDTHxHEIGHT')
+    parser.add_argument('--remove-sizes', default='640x480,1920x1080', help='Image sizes for the remove suite')
+    parser.add_argument('--models', default=','.join(app.AVAILABLE_MODELS), help='Models for the remove suite')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed iterations per case')
+    parser.add_argument('--comfy-delay', type=float, default=0.5, help='Seconds each fake ComfyUI prompt takes')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='Seconds between /check-status polls')
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    suites = [s.strip() for s in args.suites.split(',') if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+
+    # Measure the work itself, not cache hits
+    for cache in (app.result_cache, app.mask_cache):
+        cache.max_bytes = 0
+        cache.disk_dir = None
+
+    runner = Runner(args.repeat)
+    sizes = parse_sizes(args.sizes)
+    if 'fit' in suites:
+        bench_fit(runner, sizes)
+    if 'resize' in suites:
+        bench_resize(runner, sizes)
+    if 'encode' in suites:
+        bench_encode(runner, sizes)
+    if 'remove' in suites:
+        bench_remove(runner, parse_sizes(args.remove_sizes), [m for m in args.models.split(',') if m])
+    if 'workflow' in suites:
+        bench_workflow(runner)
+    if 'comfyui' in suites:
+        bench_comfyui(runner, args.comfy_delay, args.poll_interval)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': runner.results,
+    }
+    output = Path(args.output) if args.output else \
+        ROOT / 'benchmarks' / 'results' / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(runner.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
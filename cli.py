@@ -0,0 +1,215 @@
+"""Offline background removal over a directory tree, without going through HTTP.
+
+Usage:
+    python cli.py INPUT_DIR OUTPUT_DIR [--settings settings.json] [--manifest files.txt]
+        [--workers N] [--format png|webp] [--quality Q] [--overwrite]
+
+Every image under INPUT_DIR (or each path listed in --manifest, one per line, relative to
+INPUT_DIR) goes through app.process_image with the settings from --settings, the same JSON
+the frontend sends. The result is written to the same relative path under OUTPUT_DIR with a
+.png or .webp extension. Outputs that already exist are skipped, so an interrupted run picks
+up where it stopped; files are written under a temporary name and renamed when complete.
+
+Images are processed by --workers processes (default: CPU count), each loading its model
+session once at startup. Each worker's onnxruntime threads get an equal share of the cores.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+# Same defaults as the frontend's processing controls
+DEFAULT_SETTINGS = {
+    'foreground_threshold': 50,
+    'erode_size': 3,
+}
+PROGRESS_INTERVAL = 10  # seconds between progress lines
+MAX_LISTED_FAILURES = 20
+
+# Set in each worker by init_worker
+_settings = None
+_encoding = None
+_init_error = None
+
+
+def find_images(input_dir, manifest=None):
+    """Paths of the images to process, relative to input_dir, in a stable order"""
+    from app import BATCH_IMAGE_EXTENSIONS
+    if manifest:
+        paths = []
+        for line in Path(manifest).read_text().splitlines():
+            line = line.strip()
+            if line and not line.startswith('#'):
+                path = Path(line)
+                paths.append(path.relative_to(input_dir) if path.is_absolute() else path)
+        return paths
+    return sorted(
+        path.relative_to(input_dir) for path in input_dir.rglob('*')
+        if path.is_file() and path.suffix.lower() in BATCH_IMAGE_EXTENSIONS
+        and not any(part.startswith('.') for part in path.relative_to(input_dir).parts)
+    )
+
+
+def init_worker(settings, encoding):
+    """Pool initializer: load the model session once so every image in this worker reuses it"""
+    global _settings, _encoding, _init_error
+    import app
+    _settings, _encoding = settings, encoding
+    try:
+        app.session_pool.get(settings.get('model'))
+    except Exception as e:
+        _init_error = f"Failed to load model {settings.get('model') or app.session_pool.default_model}: {e}"
+
+
+def process_file(task):
+    """Process one image; returns (relative path, status, seconds, pixels, error)"""
+    import app
+    rel, source, target = task
+    if _init_error:
+        return rel, 'fatal', 0, 0, _init_error
+
+    start = time.perf_counter()
+    partial = target.with_name(f".{target.name}.partial")
+    try:
+        with open(source, 'rb') as f:
+            image = app.open_image(f)
+            pixels = image.width * image.height
+            result = app.process_image(image, _settings)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(partial, 'wb') as f:
+            app.encode_image(result, f, _encoding)
+        os.replace(partial, target)
+    except Exception as e:
+        partial.unlink(missing_ok=True)
+        return rel, 'failed', time.perf_counter() - start, 0, str(e)
+    return rel, 'done', time.perf_counter() - start, pixels, None
+
+
+def output_encoding(args):
+    """An encoding dict as accepted by app.encode_image"""
+    if args.format == 'webp':
+        return {'format': 'webp', 'quality': args.quality} if args.quality else {'format': 'webp', 'lossless': True}
+    return {'format': 'png', 'compress_level': args.compress_level}
+
+
+def plan_tasks(paths, input_dir, output_dir, suffix, overwrite):
+    """Split paths into tasks to run and the number skipped because their output exists.
+    Inputs that would write the same output (e.g. a.jpg and a.png) keep only the first."""
+    tasks, skipped, seen = [], 0, {}
+    for rel in paths:
+        target = output_dir / rel.with_suffix(suffix)
+        if target in seen:
+            print(f"Skipping {rel}: its output {target} is already written by {seen[target]}")
+            continue
+        seen[target] = rel
+        if target.exists() and not overwrite:
+            skipped += 1
+            continue
+        tasks.append((rel, input_dir / rel, target))
+    return tasks, skipped
+
+
+def run(tasks, settings, encoding, workers):
+    """Process tasks, printing progress; returns (done, failures, megapixels, fatal error or None)"""
+    done, failures, megapixels = 0, [], 0.0
+    start = last_report = time.perf_counter()
+
+    if workers == 1:
+        init_worker(settings, encoding)
+        results, pool = map(process_file, tasks), None
+    else:
+        pool = Pool(workers, initializer=init_worker, initargs=(settings, encoding))
+        results = pool.imap_unordered(process_file, tasks)
+
+    try:
+        for rel, status, seconds, pixels, error in results:
+            if status == 'fatal':
+                return done, failures, megapixels, error
+            if status == 'failed':
+                print(f"Failed {rel}: {error}")
+                failures.append((rel, error))
+            else:
+                done += 1
+                megapixels += pixels / 1e6
+
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                finished = done + len(failures)
+                print(f"[{finished}/{len(tasks)}] {finished / (now - start):.2f} images/s, "
+                      f"{len(failures)} failed")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return done, failures, megapixels, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove backgrounds from a directory of images')
+    parser.add_argument('input', type=Path, help='Directory of images to process')
+    parser.add_argument('output', type=Path, help='Directory to write results to, mirroring the input tree')
+    parser.add_argument('--settings', type=Path, help='JSON file of process_image settings, as sent by the frontend')
+    parser.add_argument('--manifest', type=Path, help='File listing the images to process, one path per line')
+    parser.add_argument('--model', help='Model to use, overriding the settings file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--format', choices=('png', 'webp'), default='png')
+    parser.add_argument('--compress-level', type=int, default=None, help='PNG zlib level, 0-9')
+    parser.add_argument('--quality', type=int, default=None, help='Lossy WebP quality, 1-100 (lossless if unset)')
+    parser.add_argument('--overwrite', action='store_true', help='Reprocess images whose output already exists')
+    args = parser.parse_args()
+
+    settings = dict(DEFAULT_SETTINGS)
+    if args.settings:
+        settings.update(json.loads(args.settings.read_text()))
+    if args.model:
+        settings['model'] = args.model
+    workers = max(1, args.workers)
+
+    # Configure app for a single-threaded worker per process before importing it: split the
+    # cores between workers, skip the batching thread hop and the mask cache (each image is
+    # seen once), and leave model loading to the workers
+    os.environ.setdefault('INFERENCE_CONCURRENCY', str(workers))
+    os.environ.setdefault('BATCH_INFERENCE', '0')
+    os.environ.setdefault('MASK_CACHE_MAX_BYTES', '0')
+    os.environ.pop('REMBG_PRELOAD_MODELS', None)
+    import app
+
+    if args.compress_level is None:
+        args.compress_level = app.PNG_COMPRESS_LEVEL
+    if settings.get('model') and settings['model'] not in app.AVAILABLE_MODELS:
+        parser.error(f"Unknown model: {settings['model']}")
+
+    input_dir = args.input.resolve()
+    if not input_dir.is_dir():
+        parser.error(f"Not a directory: {args.input}")
+    output_dir = args.output.resolve()
+    encoding = output_encoding(args)
+
+    paths = find_images(input_dir, args.manifest)
+    tasks, skipped = plan_tasks(paths, input_dir, output_dir, f".{args.format}", args.overwrite)
+    print(f"{len(paths)} images: {len(tasks)} to process, {skipped} already done; {workers} workers")
+    if not tasks:
+        return 0
+
+    start = time.perf_counter()
+    done, failures, megapixels, fatal = run(tasks, settings, encoding, min(workers, len(tasks)))
+    elapsed = time.perf_counter() - start
+    if fatal:
+        print(fatal)
+        return 2
+
+    print(f"Processed {done} images in {elapsed:.1f}s: {done / elapsed:.2f} images/s, "
+          f"{megapixels / elapsed:.2f} MP/s; {skipped} skipped, {len(failures)} failed")
+    for rel, error in failures[:MAX_LISTED_FAILURES]:
+        print(f"  {rel}: {error}")
+    if len(failures) > MAX_LISTED_FAILURES:
+        print(f"  ... and {len(failures) - MAX_LISTED_FAILURES} more")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
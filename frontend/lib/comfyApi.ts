@@ -76,12 +76,9 @@ export async function generateImages(settings: GenerationSettings): Promise<Gene
 }
 
 export async function saveTempImage(imageUrl: string): Promise<string> {
-  const imageResponse = await fetch(imageUrl);
-  if (!imageResponse.ok) throw new Error('Failed to fetch generated image');
-  const imageBlob = await imageResponse.blob();
-
+  // The server copies the image straight from ComfyUI, so it isn't downloaded and re-uploaded here
   const formData = new FormData();
-  formData.append('image', imageBlob, 'generated.png');
+  formData.append('comfyui_image', imageUrl);
 
   const saveResponse = await fetch('/save-temp-image', {
     method: 'POST',
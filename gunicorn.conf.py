@@ -0,0 +1,49 @@
+"""Gunicorn settings for serving the backend in production:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master and forked into WEB_CONCURRENCY worker processes,
+each with GUNICORN_THREADS request threads. Model sessions are never loaded in the master
+(onnxruntime's thread pools don't survive a fork); instead every worker loads
+REMBG_PRELOAD_MODELS in the background as soon as it starts, and /readyz reports 503 until
+they're loaded. The default model set through /switch-model is shared by all workers.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+# Inference is CPU-bound and onnxruntime already uses several threads per run, so a few
+# processes with a handful of threads each beat many processes
+workers = int(os.environ.get('WEB_CONCURRENCY', max(1, multiprocessing.cpu_count() // 2)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Seconds a worker may go without responding before it is killed and replaced; must cover
+# the slowest request (large images with alpha matting, ComfyUI pipelines)
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to cap memory growth from fragmentation
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+preload_app = True
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
+accesslog = '-'
+
+# The app splits the cores between the workers' onnxruntime threads (see INFERENCE_CONCURRENCY)
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+
+# Keep the master from loading models while it imports the app; post_fork loads them in each
+# worker instead. The list is moved to another variable so it survives config reloads (SIGHUP)
+if 'REMBG_PRELOAD_MODELS' in os.environ:
+    os.environ['WORKER_PRELOAD_MODELS'] = os.environ.pop('REMBG_PRELOAD_MODELS')
+preload_models = [m.strip() for m in os.environ.get('WORKER_PRELOAD_MODELS', '').split(',') if m.strip()]
+
+
+def post_fork(server, worker):
+    from app import model_preloader
+    if preload_models:
+        model_preloader.start(preload_models)
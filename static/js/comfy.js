@@ -26,8 +26,19 @@ class ComfyUI {
             const item = document.createElement('div');
             item.className = 'base-image-item';
             
+            // Load a thumbnail sized for the grid cell instead of the full image;
+            // images smaller than every thumbnail size have none and use the original
             const img = document.createElement('img');
-            img.src = image.url;
+            const thumbnails = image.thumbnails || [];
+            const thumbnail = thumbnails.find(t => t.size >= 128) || thumbnails[thumbnails.length - 1];
+            img.src = thumbnail ? thumbnail.url : image.url;
+            if (thumbnails.length) {
+                img.srcset = thumbnails.map(t => `${t.url} ${t.width}w`)
+                    .concat(`${image.url} ${image.width}w`).join(', ');
+                img.sizes = '120px';
+            }
+            img.loading = 'lazy';
+            img.decoding = 'async';
             img.alt = image.name;
             
             const name = document.createElement('div');
@@ -202,16 +213,10 @@ class ComfyUI {
 
     async handleImageClick(imageUrl) {
         try {
-            // Fetch the image from ComfyUI
-            const response = await fetch(imageUrl);
-            if (!response.ok) throw new Error('Failed to fetch image');
-            const blob = await response.blob();
-            
-            // Create a new FormData and append the blob as a File
+            // Have our server copy the image straight from ComfyUI into temp storage
             const formData = new FormData();
-            formData.append('image', blob, 'generated.png');
+            formData.append('comfyui_image', imageUrl);
             
-            // Send to our server to store temporarily
             const saveResponse = await fetch('/save-temp-image', {
                 method: 'POST',
                 body: formData
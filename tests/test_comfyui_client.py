@@ -0,0 +1,69 @@
+import http.client
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+    return app.ComfyUIClient(api_url='http://comfyui.invalid', max_retries=2)
+
+
+def failing(client, monkeypatch, error):
+    """Make every request raise error; returns the list of attempted (method, url)"""
+    calls = []
+
+    def request(method, url, **kwargs):
+        calls.append((method, url))
+        raise error
+
+    monkeypatch.setattr(client.session, 'request', request)
+    return calls
+
+
+def connection_refused():
+    reason = NewConnectionError(None, 'Failed to establish a new connection: [Errno 111] Connection refused')
+    return requests.ConnectionError(MaxRetryError(None, '/prompt', reason=reason))
+
+
+def test_post_is_retried_when_the_connection_was_never_made(client, monkeypatch):
+    calls = failing(client, monkeypatch, connection_refused())
+    with pytest.raises(requests.ConnectionError):
+        client.post('/prompt', json={})
+    assert len(calls) == 3
+
+
+def test_post_prompt_is_not_retried_after_connecting(client, monkeypatch):
+    # The request went out and the connection dropped before the response: the prompt may
+    # already be queued, so retrying would queue it twice
+    disconnected = http.client.RemoteDisconnected('Remote end closed connection without response')
+    error = requests.ConnectionError(ProtocolError('Connection aborted.', disconnected))
+    calls = failing(client, monkeypatch, error)
+    with pytest.raises(requests.ConnectionError):
+        client.post('/prompt', json={})
+    assert len(calls) == 1
+
+
+def test_post_read_timeout_is_not_retried(client, monkeypatch):
+    calls = failing(client, monkeypatch, requests.ReadTimeout('Read timed out'))
+    with pytest.raises(requests.ReadTimeout):
+        client.post('/prompt', json={})
+    assert len(calls) == 1
+
+
+def test_retry_does_not_depend_on_the_message(client, monkeypatch):
+    calls = failing(client, monkeypatch, requests.ConnectionError('NewConnectionError in the text only'))
+    with pytest.raises(requests.ConnectionError):
+        client.post('/prompt', json={})
+    assert len(calls) == 1
+
+
+def test_get_is_retried_after_connecting(client, monkeypatch):
+    calls = failing(client, monkeypatch, requests.ReadTimeout('Read timed out'))
+    with pytest.raises(requests.ReadTimeout):
+        client.get('/history')
+    assert len(calls) == 3
@@ -0,0 +1,93 @@
+import multiprocessing
+
+import app
+
+
+def child_client_id(tracker, results):
+    results.put(tracker.client_id)
+
+
+def test_client_id_is_unique_per_forked_process():
+    # With preload_app the tracker is created in the gunicorn master before the workers fork
+    tracker = app.ComfyUITracker()
+    parent_id = tracker.client_id
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=child_client_id, args=(tracker, results)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    child_ids = {results.get(timeout=10) for _ in workers}
+    for worker in workers:
+        worker.join()
+
+    assert len(child_ids) == 2
+    assert parent_id not in child_ids
+    assert tracker.client_id == parent_id
+
+
+def test_explicit_client_id_is_kept():
+    assert app.ComfyUITracker(client_id='fixed').client_id == 'fixed'
+
+
+class HistoryResponse:
+    ok = True
+
+    def __init__(self, history):
+        self.history = history
+
+    def json(self):
+        return self.history
+
+
+def completed_history(monkeypatch, prompt_id):
+    """Make /history report the prompt as completed; returns the list of requested paths"""
+    calls = []
+
+    def get(path, **kwargs):
+        calls.append(path)
+        return HistoryResponse({prompt_id: {'status': {'completed': True}, 'outputs': {}}})
+
+    monkeypatch.setattr(app.comfy_client, 'get', get)
+    return calls
+
+
+def connected_tracker(monkeypatch):
+    tracker = app.ComfyUITracker()
+    monkeypatch.setattr(tracker, 'start', lambda: None)
+    tracker.connected.set()
+    return tracker
+
+
+def test_status_trusts_the_websocket_for_recently_checked_prompts(monkeypatch):
+    tracker = connected_tracker(monkeypatch)
+    calls = completed_history(monkeypatch, 'p1')
+    state = tracker.track('p1')
+
+    assert tracker.status('p1')['status'] == 'pending'
+    assert calls == []
+    assert not state['done'].is_set()
+
+
+def test_status_checks_history_for_prompts_pending_past_the_poll_interval(monkeypatch):
+    tracker = connected_tracker(monkeypatch)
+    calls = completed_history(monkeypatch, 'p1')
+    state = tracker.track('p1')
+    state['checked'] -= app.COMFYUI_HISTORY_POLL_INTERVAL
+
+    assert tracker.status('p1')['status'] == 'completed'
+    assert calls == ['/history/p1']
+    # Once done and synced, later calls don't hit history again
+    tracker.status('p1')
+    assert calls == ['/history/p1']
+
+
+def test_status_history_checks_are_rate_limited(monkeypatch):
+    tracker = connected_tracker(monkeypatch)
+    calls = []
+    monkeypatch.setattr(app.comfy_client, 'get', lambda path, **kwargs: calls.append(path) or HistoryResponse({}))
+    state = tracker.track('p1')
+    state['checked'] -= app.COMFYUI_HISTORY_POLL_INTERVAL
+
+    tracker.status('p1')
+    tracker.status('p1')
+    assert calls == ['/history/p1']
@@ -0,0 +1,17 @@
+from io import BytesIO
+
+from PIL import Image
+
+import app
+
+
+def test_encode_bytes_defaults_to_png():
+    image = Image.new('RGBA', (4, 4), (255, 0, 0, 128))
+    decoded = Image.open(BytesIO(app.encode_bytes(image)))
+    assert decoded.format == 'PNG' and decoded.mode == 'RGBA'
+
+
+def test_encode_bytes_webp():
+    image = Image.new('RGBA', (4, 4), (255, 0, 0, 128))
+    body = app.encode_bytes(image, app.make_encoding('webp', quality=80))
+    assert Image.open(BytesIO(body)).format == 'WEBP'
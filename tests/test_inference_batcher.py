@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import app
+
+
+class InvalidArgument(Exception):
+    """Same name as the onnxruntime exception for rejected input shapes"""
+
+
+class FakeInner:
+    def __init__(self, batch_error):
+        self.batch_error = batch_error
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='input')]
+
+    def run(self, outputs, feed):
+        tensor = feed['input']
+        self.batch_sizes.append(len(tensor))
+        if len(tensor) > 1 and self.batch_error:
+            raise self.batch_error
+        return [tensor.mean(axis=1, keepdims=True)]
+
+
+def make_batcher(batch_error):
+    inner = FakeInner(batch_error)
+    pool = SimpleNamespace(get=lambda model_name: SimpleNamespace(inner_session=inner))
+    return app.InferenceBatcher(pool), inner
+
+
+def tensors(n):
+    return [np.full((1, 3, 4, 4), i, dtype=np.float32) for i in range(n)]
+
+
+def test_batch_dimension_error_disables_batching():
+    error = InvalidArgument('Got invalid dimensions for input: x for the following indices index: 0 Got: 2 Expected: 1')
+    batcher, inner = make_batcher(error)
+    preds = batcher._run('u2net', tensors(2))
+    assert [float(p[0, 0]) for p in preds] == [0.0, 1.0]
+    assert 'u2net' in batcher._unbatchable
+
+    batcher._run('u2net', tensors(2))
+    assert inner.batch_sizes == [2, 1, 1, 1, 1]
+
+
+def test_other_errors_fall_back_for_that_batch_only():
+    batcher, inner = make_batcher(MemoryError('out of memory'))
+    preds = batcher._run('u2net', tensors(3))
+    assert [float(p[0, 0]) for p in preds] == [0.0, 1.0, 2.0]
+    assert 'u2net' not in batcher._unbatchable
+
+    inner.batch_error = None
+    batcher._run('u2net', tensors(2))
+    assert inner.batch_sizes == [3, 1, 1, 1, 2]
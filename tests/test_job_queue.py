@@ -0,0 +1,42 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+def test_cancelled_jobs_free_their_queue_slots():
+    # No workers, so submitted jobs stay queued
+    jobs = app.JobQueue(workers=0, max_depth=3)
+    ids = [jobs.submit(lambda job: b'') for _ in range(3)]
+    with pytest.raises(app.JobQueueFull):
+        jobs.submit(lambda job: b'')
+
+    for job_id in ids:
+        assert jobs.cancel(job_id)['status'] == 'cancelled'
+    assert jobs.depth() == 0
+
+    for _ in range(3):
+        jobs.submit(lambda job: b'')
+    assert jobs.depth() == 3
+
+
+def test_workers_skip_cancelled_jobs():
+    jobs = app.JobQueue(workers=1, max_depth=3)
+    release = threading.Event()
+    ran = []
+    # The first job holds the only worker so the next two stay queued
+    blocker = jobs.submit(lambda job: release.wait(5) and b'')
+    cancelled = jobs.submit(lambda job: ran.append('cancelled'))
+    kept = jobs.submit(lambda job: ran.append('kept') or b'done')
+    jobs.cancel(cancelled)
+    release.set()
+
+    deadline = time.monotonic() + 5
+    while jobs.get(kept)['status'] != 'completed' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ran == ['kept']
+    assert jobs.get(kept)['result'] == b'done'
+    assert jobs.get(blocker)['status'] == 'completed'
+    assert jobs.depth() == 0
@@ -0,0 +1,33 @@
+from PIL import Image
+
+import app
+
+
+class FakeSession:
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, img, *args, **kwargs):
+        self.calls += 1
+        return [img.convert('L')]
+
+
+def test_masks_are_cached_per_image(monkeypatch):
+    monkeypatch.setattr(app, 'mask_cache', app.ResultCache(max_bytes=1024 * 1024, disk_dir=None))
+    inner = FakeSession()
+    image = Image.new('RGB', (8, 8), 'red')
+    app.CachedMaskSession(inner, 'u2net').predict(image)
+    app.CachedMaskSession(inner, 'u2net').predict(image)
+    assert inner.calls == 1
+
+
+def test_disabled_mask_cache_skips_hashing(monkeypatch):
+    monkeypatch.setattr(app, 'mask_cache', app.ResultCache(max_bytes=0, disk_dir=None))
+
+    def image_digest(img):
+        raise AssertionError('pixels hashed with the mask cache disabled')
+
+    monkeypatch.setattr(app, 'image_digest', image_digest)
+    inner = FakeSession()
+    masks = app.CachedMaskSession(inner, 'u2net').predict(Image.new('RGB', (8, 8), 'red'))
+    assert masks[0].size == (8, 8) and inner.calls == 1
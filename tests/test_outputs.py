@@ -0,0 +1,70 @@
+import json
+import zipfile
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import app
+
+OUTPUTS = [{'width': 200}, {'width': 50, 'format': 'webp'}, {'width': 100, 'name': 'medium'}]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Stand in for background removal: the pipeline returns the decoded image as RGBA
+    monkeypatch.setattr(app, '_process_image', lambda image, settings, image_hash, progress: image.convert('RGBA'))
+    monkeypatch.setattr(app, 'result_cache', app.ResultCache(max_bytes=0, disk_dir=None))
+    return app.app.test_client()
+
+
+def upload():
+    buffer = BytesIO()
+    Image.new('RGB', (400, 300), 'red').save(buffer, 'PNG')
+    return BytesIO(buffer.getvalue()), 'icon.png'
+
+
+def test_outputs_are_returned_in_one_zip(client):
+    response = client.post('/remove-background', data={
+        'image': upload(), 'settings': json.dumps({'outputs': OUTPUTS}),
+    })
+    assert response.status_code == 200 and response.mimetype == 'application/zip'
+
+    archive = zipfile.ZipFile(BytesIO(response.data))
+    manifest = json.loads(archive.read('manifest.json'))['items']
+    assert [(item['width'], item['height'], item['format']) for item in manifest] == \
+        [(200, 150, 'png'), (50, 38, 'webp'), (100, 75, 'png')]
+    assert manifest[2]['output'] == '0002_medium.png'
+    for item in manifest:
+        image = Image.open(BytesIO(archive.read(item['output'])))
+        assert image.size == (item['width'], item['height'])
+        assert image.format == item['format'].upper()
+
+
+def test_cascade_scales_each_size_from_the_closest_larger_one(monkeypatch):
+    sources = []
+    scale_image = app.scale_image
+
+    def spy(image, size, resample='lanczos', reducing_gap=None):
+        sources.append((image.size, size))
+        return scale_image(image, size, resample, reducing_gap)
+
+    monkeypatch.setattr(app, 'scale_image', spy)
+    images = app.scale_cascade(Image.new('RGBA', (400, 300)), [(50, 38), (200, 150), (100, 75), (200, 150)])
+    assert [image.size for image in images] == [(50, 38), (200, 150), (100, 75), (200, 150)]
+    assert sources == [((400, 300), (200, 150)), ((200, 150), (100, 75)), ((100, 75), (50, 38))]
+
+
+def test_async_with_outputs_is_rejected(client):
+    response = client.post('/remove-background', data={
+        'image': upload(), 'settings': json.dumps({'outputs': OUTPUTS}), 'async': 'true',
+    })
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('outputs', [[{'width': 0}], [{}], [{'width': 10, 'format': 'gif'}], 'x'])
+def test_invalid_outputs_are_rejected(client, outputs):
+    response = client.post('/remove-background', data={
+        'image': upload(), 'settings': json.dumps({'outputs': outputs}),
+    })
+    assert response.status_code == 400
@@ -0,0 +1,41 @@
+import json
+import logging
+from io import BytesIO
+
+from PIL import Image
+
+import app
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_logger_is_configured_at_import():
+    # Served by gunicorn, nothing else sets up a handler for the app's logger
+    assert app.logger.handlers
+    assert app.logger.isEnabledFor(logging.INFO)
+
+
+def test_request_timing_record_is_logged():
+    buffer = BytesIO()
+    Image.new('RGBA', (32, 32), (255, 0, 0, 255)).save(buffer, 'PNG')
+    handler = Records()
+    app.logger.addHandler(handler)
+    try:
+        response = app.app.test_client().post('/fit-to-canvas', data={
+            'image': (BytesIO(buffer.getvalue()), 'timing.png'), 'padding': '10',
+        })
+    finally:
+        app.logger.removeHandler(handler)
+
+    assert response.status_code == 200
+    timings = [json.loads(r.getMessage()) for r in handler.records if 'request_timing' in r.getMessage()]
+    assert len(timings) == 1
+    assert timings[0]['endpoint'] == '/fit-to-canvas'
+    assert {'decode', 'fit_to_canvas', 'encode'} <= set(timings[0]['stages_ms'])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import app
+
+SIZES = [
+    ((300, 200), (37, 25)),     # 8x downscale
+    ((300, 200), (150, 100)),
+    ((64, 48), (200, 151)),     # upscale
+    ((40, 4100), (30, 20)),     # very tall image shrinking vertically
+    ((301, 199), (300, 7)),
+]
+
+
+def noise(size, mode):
+    rng = np.random.default_rng(size[0] * 31 + size[1])
+    bands = len(mode)
+    pixels = rng.integers(0, 256, (size[1], size[0], bands), dtype=np.uint8)
+    if mode == 'RGBA':
+        # Fully transparent and opaque regions, so premultiplication matters
+        pixels[:, : size[0] // 3, 3] = 0
+        pixels[:, size[0] // 3: 2 * size[0] // 3, 3] = 255
+    return Image.fromarray(pixels[:, :, 0] if bands == 1 else pixels, mode)
+
+
+@pytest.fixture(params=[1, 3])
+def workers(request, monkeypatch):
+    """Run each case in one pass and in parallel strips"""
+    monkeypatch.setattr(app, 'RESIZE_WORKERS', request.param)
+    monkeypatch.setattr(app, 'RESIZE_PARALLEL_MIN_PIXELS', 0 if request.param > 1 else 10 ** 12)
+    return request.param
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'RGB', 'L'])
+@pytest.mark.parametrize('source, target', SIZES)
+def test_lanczos_matches_pil(workers, mode, source, target):
+    image = noise(source, mode)
+    expected = image.resize(target, Image.Resampling.LANCZOS)
+    result = app.scale_image(image, target)
+    assert result.mode == expected.mode
+    assert result.tobytes() == expected.tobytes()
+
+
+def test_reducing_gap_is_close_to_a_plain_resize(workers):
+    image = noise((600, 400), 'RGB')
+    expected = np.asarray(image.resize((60, 40), Image.Resampling.LANCZOS), dtype=int)
+    result = np.asarray(app.scale_image(image, (60, 40), reducing_gap=3.0), dtype=int)
+    assert np.abs(result - expected).mean() < 4
+
+
+def test_fit_to_canvas_large_downscale_is_unchanged(monkeypatch):
+    # Even with a reducing gap configured for the resize steps, fit_to_canvas stays exact
+    monkeypatch.setattr(app, 'RESIZE_REDUCING_GAP', 3.0)
+    image = noise((400, 300), 'RGBA')
+    image.putalpha(255)
+    # Opaque images shrink to (1 - padding) of the canvas, here about 10x
+    width, height = int(400 * (1 - 90 / 100)), int(300 * (1 - 90 / 100))
+    expected = Image.new('RGBA', image.size, (0, 0, 0, 0))
+    expected.paste(image.resize((width, height), Image.Resampling.LANCZOS), ((400 - width) // 2, (300 - height) // 2))
+    assert app.fit_to_canvas(image, 90).tobytes() == expected.tobytes()
@@ -0,0 +1,35 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Record model loads, with create_session returning a stand-in session"""
+    loaded = []
+
+    def create_session(model_name):
+        loaded.append(model_name)
+        return object()
+
+    monkeypatch.setattr(app, 'create_session', create_session)
+    return loaded
+
+
+def test_pool_of_one_keeps_the_model_just_loaded(loads):
+    pool = app.SessionPool(max_size=1, default_model='u2net')
+    pool.get('u2net')
+    session = pool.get('silueta')
+    assert pool.loaded_models() == ['silueta']
+    # Repeated requests for the non-default model reuse its session
+    assert pool.get('silueta') is session
+    assert loads == ['u2net', 'silueta']
+
+
+def test_eviction_is_least_recently_used_and_spares_the_default(loads):
+    pool = app.SessionPool(max_size=3, default_model='u2net')
+    for model in ('u2net', 'silueta', 'isnet-general-use'):
+        pool.get(model)
+    pool.get('silueta')
+    pool.get('u2net_human_seg')
+    assert sorted(pool.loaded_models()) == ['silueta', 'u2net', 'u2net_human_seg']
@@ -0,0 +1,49 @@
+import io
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = app.TempStore(directory=tmp_path)
+    monkeypatch.setattr(store, '_start', lambda: None)
+    return store
+
+
+def test_identical_content_is_stored_once(store):
+    first = store.save(io.BytesIO(b'image bytes'), 'a.png')
+    second = store.save(io.BytesIO(b'image bytes'), 'b.png')
+
+    assert first == second
+    assert store.path(first).read_bytes() == b'image bytes'
+    assert store.stats()['saves'] == 1
+    assert store.stats()['dedup_hits'] == 1
+
+
+def test_seekable_stream_is_hashed_before_writing(store, monkeypatch):
+    name = store.save(io.BytesIO(b'image bytes'), 'a.png')
+    opened = []
+    real_open = open
+    monkeypatch.setattr('builtins.open', lambda *args, **kwargs: opened.append(args) or real_open(*args, **kwargs))
+
+    assert store.save(io.BytesIO(b'image bytes'), 'a.png') == name
+    assert opened == []
+    assert [p.name for p in store.directory.iterdir()] == [name]
+
+
+def test_writer_function_content_is_deduplicated_after_writing(store):
+    name = store.save(io.BytesIO(b'image bytes'), 'a.png')
+
+    assert store.save(lambda f: f.write(b'image bytes'), 'a.png') == name
+    assert [p.name for p in store.directory.iterdir()] == [name]
+    assert store.stats()['dedup_hits'] == 1
+
+
+def test_different_content_gets_different_names(store):
+    first = store.save(io.BytesIO(b'one'), 'a.png')
+    second = store.save(io.BytesIO(b'two'), 'a.png')
+
+    assert first != second
+    assert store.path(second).read_bytes() == b'two'